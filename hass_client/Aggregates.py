@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+import time
+
+
+def parseWindows(value):
+    # '300,3600' -> [300, 3600], invalid or non positive entries are ignored
+    windows = []
+    for part in (value or '').split(','):
+        try:
+            seconds = int(part.strip())
+        except ValueError:
+            continue
+        if seconds > 0 and seconds not in windows:
+            windows.append(seconds)
+    return sorted(windows)
+
+
+def windowLabel(seconds):
+    if seconds % 3600 == 0:
+        return '%sh' % (seconds // 3600)
+    if seconds % 60 == 0:
+        return '%sm' % (seconds // 60)
+    return '%ss' % seconds
+
+
+class RollingWindow(object):
+    # time based window with amortized O(1) updates,
+    # min/max are kept in monotonic queues and mean from a running sum
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = deque()
+        self.minQueue = deque()
+        self.maxQueue = deque()
+        self.total = 0.0
+
+    def add(self, value, now):
+        self.samples.append((now, value))
+        self.total += value
+        while self.minQueue and self.minQueue[-1][1] > value:
+            self.minQueue.pop()
+        self.minQueue.append((now, value))
+        while self.maxQueue and self.maxQueue[-1][1] < value:
+            self.maxQueue.pop()
+        self.maxQueue.append((now, value))
+        self.expire(now)
+
+    def expire(self, now):
+        limit = now - self.seconds
+        while self.samples and self.samples[0][0] <= limit:
+            self.total -= self.samples.popleft()[1]
+        while self.minQueue and self.minQueue[0][0] <= limit:
+            self.minQueue.popleft()
+        while self.maxQueue and self.maxQueue[0][0] <= limit:
+            self.maxQueue.popleft()
+        if not self.samples:
+            # reset to avoid float drift from the running sum
+            self.total = 0.0
+
+    def getStats(self, now):
+        self.expire(now)
+        count = len(self.samples)
+        if not count:
+            return {'count': 0}
+        return {
+            'min': self.minQueue[0][1],
+            'max': self.maxQueue[0][1],
+            'mean': round(self.total / count, 2),
+            'count': count
+        }
+
+
+class SensorAggregates(object):
+    def __init__(self, windows):
+        self.windows = [(windowLabel(x), RollingWindow(x)) for x in windows]
+
+    def add(self, value, now=None):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        now = time.time() if now is None else now
+        for _, window in self.windows:
+            window.add(value, now)
+
+    def getStats(self, now=None):
+        now = time.time() if now is None else now
+        return dict((label, window.getStats(now)) for label, window in self.windows)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+
+
+class TimerWheel(object):
+    # hierarchical timing wheel, level n has slots of tick * slots^n seconds. Timers are
+    # cascaded to a finer level when their coarse slot comes up, adding or moving a timer
+    # is O(1) and a single advance per tick expires any number of them
+    def __init__(self, tick, slots=64, levels=4, now=None):
+        self.tick = float(tick)
+        self.slots = slots
+        self.levels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.start = time.time() if now is None else now
+        self.current = 0
+        self.deadlines = {}
+        self.locations = {}
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def add(self, key, deadline):
+        self.remove(key)
+        ticks = max(int(math.ceil((deadline - self.start) / self.tick)), self.current + 1)
+        self.deadlines[key] = ticks
+        self._place(key, ticks)
+
+    def remove(self, key):
+        location = self.locations.pop(key, None)
+        if location:
+            self.levels[location[0]][location[1]].discard(key)
+        self.deadlines.pop(key, None)
+
+    def _place(self, key, ticks):
+        delta = ticks - self.current
+        for level in range(len(self.levels)):
+            # timers beyond the range of the last level wrap around and are placed again
+            if delta < self.slots ** (level + 1) or level == len(self.levels) - 1:
+                slot = (ticks // self.slots ** level) % self.slots
+                self.levels[level][slot].add(key)
+                self.locations[key] = (level, slot)
+                return
+
+    def advance(self, now=None):
+        # returns the keys whose deadline passed
+        now = time.time() if now is None else now
+        target = int((now - self.start) / self.tick)
+        expired = []
+        while self.current < target:
+            self.current += 1
+            for level in range(1, len(self.levels)):
+                if self.current % self.slots ** level:
+                    break
+                slot = (self.current // self.slots ** level) % self.slots
+                keys, self.levels[level][slot] = self.levels[level][slot], set()
+                for key in keys:
+                    self._place(key, self.deadlines[key])
+            slot = self.current % self.slots
+            keys, self.levels[0][slot] = self.levels[0][slot], set()
+            for key in keys:
+                if self.deadlines[key] <= self.current:
+                    del self.deadlines[key]
+                    del self.locations[key]
+                    expired.append(key)
+                else:
+                    self._place(key, self.deadlines[key])
+        return expired
+
+
+class _Entry(object):
+    def __init__(self, item, deviceId, timeout):
+        self.item = item
+        self.deviceId = deviceId
+        self.timeout = timeout
+        self.lastSeen = None
+        self.available = True
+
+
+class AvailabilityTracker(object):
+    # per entity availability from last seen timestamps, an entity not seen for its
+    # timeout goes offline and comes back online with the next signal from its device
+    def __init__(self, tick=5, now=None):
+        self.tick = tick
+        self.wheel = TimerWheel(tick, now=now)
+        self.entries = {}
+        self.byDevice = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def isTracked(self, key):
+        return key in self.entries
+
+    def isAvailable(self, key):
+        entry = self.entries.get(key)
+        return entry.available if entry else True
+
+    def track(self, key, item, deviceId, timeout, lastSeen=None, now=None):
+        # start tracking or update an entity, returns the item if its availability changed
+        now = time.time() if now is None else now
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _Entry(item, deviceId, timeout)
+            self.byDevice.setdefault(deviceId, set()).add(key)
+            # never seen since start, give the device a full timeout to report
+            entry.lastSeen = min(lastSeen, now) if lastSeen else now
+        entry.item = item
+        entry.timeout = timeout
+        return self._update(key, entry, now)
+
+    def untrack(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.wheel.remove(key)
+            keys = self.byDevice.get(entry.deviceId)
+            keys.discard(key)
+            if not keys:
+                del self.byDevice[entry.deviceId]
+
+    def retain(self, keys):
+        for key in [x for x in self.entries if x not in keys]:
+            self.untrack(key)
+
+    def seen(self, deviceId, now=None):
+        # returns the items that came back online
+        now = time.time() if now is None else now
+        changed = []
+        for key in self.byDevice.get(deviceId, ()):
+            entry = self.entries[key]
+            entry.lastSeen = now
+            if self._update(key, entry, now):
+                changed.append(entry.item)
+        return changed
+
+    def advance(self, now=None):
+        # returns the items that went offline
+        now = time.time() if now is None else now
+        changed = []
+        for key in self.wheel.advance(now):
+            entry = self.entries[key]
+            if self._update(key, entry, now):
+                changed.append(entry.item)
+        return changed
+
+    def _update(self, key, entry, now):
+        deadline = entry.lastSeen + entry.timeout
+        available = deadline > now
+        if available:
+            self.wheel.add(key, deadline)
+        else:
+            self.wheel.remove(key)
+        if available == entry.available:
+            return None
+        entry.available = available
+        return entry.item
@@ -1,14 +1,25 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import os
 #from time import gmtime, strftime
 
 from base import Application, Plugin, configuration, ConfigurationNumber, ConfigurationString, ConfigurationBool, ConfigurationSelect, ConfigurationList, implements, ISignalObserver, slot  # type: ignore
-from hass_client.utils import getIpAddr
+from utils import dataDir, getIpAddr, parseTypeValues, setSensorOverrides
 
 from telldus import DeviceManager  # type: ignore
 from tellduslive.base import TelldusLive  # type: ignore
 
+from Aggregates import parseWindows
+from Availability import AvailabilityTracker
+from Dedup import BurstFilter
+from DeviceCache import DeviceCache
+from Dispatcher import Dispatcher, dispatched
+from Profiling import Profiler
+from Recorder import Recorder, describeDevice
+from Registry import EntityRegistry, configHash
+from Scheduler import TimedScheduler
+from Tracing import CommandTracer
 import Devices as devs
 import logging
 import paho.mqtt.client as mqtt  # type: ignore
@@ -96,6 +107,54 @@ __name__ = 'HASSMQTT'
         description='Requires HA >= 2021.11.0',
         sortOrder=12
     ),
+    sensor_aggregates=ConfigurationString(
+        defaultValue='',
+        title='Sensor rolling aggregates',
+        description='Comma separated windows in seconds (for ex. 300,3600), publishes min/max/mean/count as sensor attributes. Empty to disable',
+        sortOrder=13
+    ),
+    record_file=ConfigurationString(
+        defaultValue='',
+        title='Record events to file',
+        description='Append Telldus signals and mqtt messages to this file for replay, empty to disable',
+        sortOrder=14
+    ),
+    dedup_windows=ConfigurationString(
+        defaultValue='',
+        title='Repeated signal windows',
+        description='Override seconds within which identical repeated signals are published once, per entity type (for ex. sensor:2,binary_sensor:1)',
+        sortOrder=15
+    ),
+    optimistic_state=ConfigurationBool(
+        defaultValue=False,
+        title='Optimistic state',
+        description='Publish the expected state of switches, lights and covers directly after a command, corrected when the device reports or the command fails',
+        sortOrder=16
+    ),
+    optimistic_timeout=ConfigurationNumber(
+        defaultValue=10,
+        title='Optimistic state timeout',
+        description='Seconds before an unconfirmed optimistic state is replaced with the last known state',
+        sortOrder=17
+    ),
+    registry_file=ConfigurationString(
+        defaultValue='',
+        title='Entity registry file',
+        description='File keeping published entities and states between restarts, empty for the default data directory',
+        sortOrder=18
+    ),
+    sensor_overrides=ConfigurationString(
+        defaultValue='',
+        title='Sensor overrides',
+        description='Json object overriding sensor name/unit/device_class/state_class per type or type_scale, for ex. {"4096_0": {"unit": "m³", "device_class": "water"}}',
+        sortOrder=19
+    ),
+    availability_timeouts=ConfigurationString(
+        defaultValue='',
+        title='Entity availability timeouts',
+        description='Seconds without signals before an entity is shown unavailable, per entity type (for ex. sensor:7200,binary_sensor:86400). Empty to only follow the hub',
+        sortOrder=20
+    ),
 
     device_topics=ConfigurationList(
         defaultValue=[],
@@ -109,11 +168,34 @@ __name__ = 'HASSMQTT'
 class Client(Plugin):
     implements(ISignalObserver)
 
+    # seconds to collect added devices before publishing them
+    addedBatchWindow = 0.5
+
     def __init__(self):
+        # all state below is owned by the dispatcher worker, entry points are @dispatched
+        self.dispatcher = Dispatcher()
         Application().registerShutdown(self.onShutdown)
         self.live = TelldusLive(self.context)  # pylint: disable=too-many-function-args
 
         self.discovered_flag = False
+        self.cache = DeviceCache()
+        self.recorder = Recorder()
+        self.recorder.open(self.config('record_file'))
+        self.tracer = CommandTracer()
+        self.tracer.onSlow = self._onSlowCommand
+        self.burstFilter = BurstFilter()
+        self.dedupWindows = parseTypeValues(self.config('dedup_windows'))
+        self.optimisticTimers = {}
+        self.availability = AvailabilityTracker()
+        self.availabilityTimeouts = parseTypeValues(self.config('availability_timeouts'))
+        self.availabilityTimer = None
+        self.addedDevices = []
+        self.addedTimer = None
+        self.registry = EntityRegistry(
+            self.config('registry_file') or os.path.join(dataDir(), 'registry.json'))
+        self.registry.load()
+        self.registrySaveTimer = None
+        self.profiler = Profiler(self.dispatcher, self._debug)
 
         self.mqtt_connected_flag = False
         self.client = mqtt.Client()
@@ -127,10 +209,10 @@ class Client(Plugin):
         if username != '':
             self.client.username_pw_set(username, password)
 
-        useConfigUrl = self.config('useConfigUrl')
-        configUrl = 'https://live.telldus.se' if self.config('configUrl') == 'live' else ('http://%s' % getIpAddr())
+        self._setSensorOverrides(self.config('sensor_overrides'))
 
-        self.hub = devs.HaHub(self.config('device_name'), self._buildTopic, configUrl if useConfigUrl else None)
+        self.subscriptions = []
+        self.hub = devs.HaHub(self.config('device_name'), self._buildTopic, self._configUrl())
         self._debug('Hub: %s' % json.dumps(self._getDeviceConfig(self.hub)))
 
         self.staticDevices = [
@@ -141,33 +223,79 @@ class Client(Plugin):
             devs.HaRamFree(self.hub, self._buildTopic),
             devs.HaNetIORecv(self.hub, self._buildTopic),
             devs.HaNetIOSent(self.hub, self._buildTopic)
+        ] + [
+            devs.HaCommandLatency(self.hub, self._buildTopic, self.tracer, x) for x in ['switch', 'light', 'cover', 'hvac']
         ]
         self.devices = self.staticDevices + []
-        Application().queue(self.discoverAndConnect)
-        Application().registerScheduledTask(self._updateTimedSensors, seconds=30)
-
+        self.scheduler = TimedScheduler(self.dispatcher, self.publishState)
+        self.dispatcher.start()
+        self.dispatcher.post(self.discoverAndConnect)
+        for haDev in self.staticDevices:
+            if isinstance(haDev, devs.HaTimedSensor):
+                self.scheduler.add(haDev)
+
+    @dispatched
     def configWasUpdated(self, key, value):
-        if key in ['use_via', 'useConfigUrl', 'configUrl', 'useEntityCategories', 'discovery_topic', 'device_name']:
-            self.devices = []
-            self.cleanupDevices()
+        if key in ['use_via', 'sensor_aggregates', 'sensor_overrides']:
+            # entities are built differently, rebuild them and publish what changed
+            if key == 'sensor_overrides':
+                self._setSensorOverrides(value)
+            self.reconfigure(True)
+        elif key in ['useConfigUrl', 'configUrl', 'useEntityCategories', 'discovery_topic', 'device_name',
+                     'availability_timeouts']:
+            # same entities, topics and/or config payloads change, migrate them in place
             self.hub.deviceName = self.config('device_name')
-            Application().queue(self.discoverAndConnect)
+            self.hub.confUrl = self._configUrl()
+            self.availabilityTimeouts = parseTypeValues(self.config('availability_timeouts'))
+            if key in ['discovery_topic', 'device_name'] and self.config('hostname'):
+                # the will is part of the session, reconnect to replace it. On connect the
+                # entities are moved to their new topics and subscriptions renewed
+                self.dispatcher.post(self.connect)
+            else:
+                self.reconfigure()
+        elif key == 'base_topic':
+            self.subscribe()
         elif key == 'state_retain' and value == False and self.mqtt_connected_flag:
             self._debug('Retain set to false, clear retained states')
             for topic in self.config('device_topics'):
                 self.client.publish('%s/%s/state' % (self.config('discovery_topic'), topic), None, 0, False)
         elif key in ['username', 'password', 'hostname', 'port']:
-            Application().queue(self.connect)
+            self.dispatcher.post(self.connect)
+        elif key == 'record_file':
+            self.recorder.open(value)
+            if self.discovered_flag:
+                # started on a running plugin, record what discovery found to make it replayable
+                self._recordDiscovery(DeviceManager(self.context).retrieveDevices())
+        elif key == 'dedup_windows':
+            self.dedupWindows = parseTypeValues(value)
+
+    def reconfigure(self, rebuild=False):
+        if not self.discovered_flag:
+            # discovery not done yet, it will use the new config
+            return
+        devices = self.devices
+        if rebuild:
+            devices = self.staticDevices + []
+            for device in DeviceManager(self.context).retrieveDevices():
+                devices.extend(self._createDevices(device))
+        self.syncDevices(devices)
+
+    def syncDevices(self, devices):
+        # replace the entity list, only entities whose topic or config differs from
+        # what the registry says is on the broker are republished, moved entities
+        # get their old topics removed and entities no longer present are cleaned up
+        self.devices = devices
+        for haDev in self.devices:
+            published = self.publishDevice(haDev, False)
+            self.publishState(haDev, onlyChanged=not published)
+        self._saveDeviceTopics()
+        self.cleanupDevices()
 
     def discoverAndConnect(self):
         self.discover()
         if self.config('hostname'):
             self.connect()
 
-    def _updateTimedSensors(self):
-        for haDev in [x for x in self.devices if isinstance(x, devs.HaTimedSensor)]:
-            self.publishState(haDev)
-
     def _debug(self, msg):
         logging.info("HaClient: %s", msg)
         if self.mqtt_connected_flag:
@@ -175,20 +303,98 @@ class Client(Plugin):
             deviceName = self.config('device_name')
             self.client.publish('%s/%s/debug' % (baseTopic, deviceName), msg, 0, False)
 
+    def _configUrl(self):
+        if not self.config('useConfigUrl'):
+            return None
+        return 'https://live.telldus.se' if self.config('configUrl') == 'live' else ('http://%s' % getIpAddr())
+
+    def _profileTopic(self):
+        return '%s/%s/profile' % (self.config('base_topic'), self.config('device_name'))
+
     def _buildTopic(self, type, id):
         return '%s/%s/%s/%s' % (self.config('discovery_topic'), type, self.config('device_name'), id)
 
+    def _setSensorOverrides(self, value):
+        try:
+            setSensorOverrides(json.loads(value) if value else None)
+        except (ValueError, TypeError, AttributeError) as e:
+            self._debug('Invalid sensor overrides %s: %s' % (value, e))
+
+    def _isRepeat(self, haDev, signature):
+        window = self.dedupWindows.get(haDev.getType(), haDev.dedupWindow)
+        return not self.burstFilter.accept(haDev.getID(), signature, window)
+
+    def _createDevices(self, device):
+        return devs.createDevices(self.cache.get(device), self.hub, self._buildTopic, self.config('use_via'),
+                                  parseWindows(self.config('sensor_aggregates')))
+
+    def _createSensorDevice(self, device, valueType, scale):
+        return devs.createSensorDevice(self.cache.get(device), self.hub, self._buildTopic, valueType, scale,
+                                       self.config('use_via'), parseWindows(self.config('sensor_aggregates')))
+
     def _getDeviceConfig(self, haDev):
         conf = haDev.getConfig()
         if not self.config('useEntityCategories'):
             conf.pop('entity_category', None)
+        if self._availabilityTimeout(haDev) and 'availability_topic' in conf:
+            # unavailable when either the hub or the entity itself is offline
+            conf['availability'] = [
+                {'topic': conf.pop('availability_topic')},
+                {'topic': '%s/availability' % haDev.getDeviceTopic()}
+            ]
+            conf['availability_mode'] = 'all'
         return conf
 
+    def _availabilityTimeout(self, haDev):
+        if not hasattr(haDev, 'device'):
+            # hub entities follow the hub
+            return 0
+        return self.availabilityTimeouts.get(haDev.getType(), 0)
+
+    def _trackAvailability(self, haDev):
+        # returns True when the availability was published
+        uniqueId = haDev.getUniqueId()
+        timeout = self._availabilityTimeout(haDev)
+        if not timeout:
+            if self.availability.isTracked(uniqueId):
+                self.availability.untrack(uniqueId)
+                if self.mqtt_connected_flag:
+                    self.client.publish('%s/availability' % haDev.getDeviceTopic(), None, 0, True)
+            return False
+        if not self.availabilityTimer:
+            self.availabilityTimer = self.dispatcher.callLater(self.availability.tick, self._availabilityTick)
+        if self.availability.track(uniqueId, haDev, haDev.device.id(), timeout, haDev.lastUpdated()):
+            self._publishAvailability(haDev)
+            return True
+        return False
+
+    def _availabilityTick(self):
+        # one periodic tick for all tracked entities
+        self.availabilityTimer = None
+        for haDev in self.availability.advance():
+            self._publishAvailability(haDev)
+        if len(self.availability):
+            self.availabilityTimer = self.dispatcher.callLater(self.availability.tick, self._availabilityTick)
+
+    def _availabilitySeen(self, deviceId):
+        for haDev in self.availability.seen(deviceId):
+            self._publishAvailability(haDev)
+
+    def _publishAvailability(self, haDev):
+        if self.mqtt_connected_flag:
+            payload = 'online' if self.availability.isAvailable(haDev.getUniqueId()) else 'offline'
+            self.client.publish('%s/availability' % haDev.getDeviceTopic(), payload, 0, True)
+
+    @dispatched
     def tearDown(self):
         # remove plugin
         self.devices = []
+        self.scheduler.clear()
         self.cleanupDevices()
         self.disconnect()
+        self._saveRegistry()
+        self.recorder.close()
+        self.dispatcher.stop()
 
     def disconnect(self):
         self.client.loop_stop()
@@ -225,68 +431,208 @@ class Client(Plugin):
             for topic in removedTopics:
                 self.removeDeviceTopics(topic)
 
+            uniqueIds = set(x.getUniqueId() for x in self.devices)
+            self.availability.retain(uniqueIds)
+            for uniqueId in self.registry.uniqueIds() - uniqueIds:
+                topic = self.registry.getTopic(uniqueId)
+                if topic and topic not in devTopics and topic not in removedTopics:
+                    self.removeDeviceTopics(topic)
+                self.registry.remove(uniqueId)
+            self._scheduleRegistrySave()
+
+    @dispatched
     def onMqttDisconnect(self, client, userdata, rc):
         self.mqtt_connected_flag = False
         self._debug('Mqtt disconnected')
 
+    @dispatched
     def onMqttConnect(self, client, userdata, flags, result):
         self.mqtt_connected_flag = True
         self._debug('Mqtt connected')
         self.publishDevices()
-        self.client.subscribe('%s/+/%s/+/set' % (self.config('discovery_topic'), self.config('device_name')))
-        self.client.subscribe('%s/+/%s/+/set/#' % (self.config('discovery_topic'), self.config('device_name')))
-        Application().queue(self.cleanupDevices)
-
+        # a new session, nothing is subscribed
+        self.subscriptions = []
+        self.subscribe()
+        self.dispatcher.post(self.cleanupDevices)
+
+    def subscribe(self):
+        # (re)subscribe to the current topics, dropping subscriptions for old prefixes
+        topics = [
+            '%s/status' % self.config('discovery_topic'),
+            self._profileTopic(),
+            '%s/+/%s/+/set' % (self.config('discovery_topic'), self.config('device_name')),
+            '%s/+/%s/+/set/#' % (self.config('discovery_topic'), self.config('device_name'))
+        ]
+        if not self.mqtt_connected_flag:
+            return
+        for topic in self.subscriptions:
+            if topic not in topics:
+                self.client.unsubscribe(topic)
+        for topic in topics:
+            if topic not in self.subscriptions:
+                self.client.subscribe(topic)
+        self.subscriptions = topics
+
+    @dispatched
     def onMqttMessage(self, client, userdata, msg):
         self._debug('Mqtt message : %s, %s' % (msg.topic, msg.payload))
+        self.recorder.record('mqtt', msg.topic, msg.payload)
+        if msg.topic == '%s/status' % self.config('discovery_topic'):
+            # home assistant birth message, it needs all configs and states again
+            if msg.payload == 'online':
+                self.publishDevices(True)
+            return
+        if msg.topic == self._profileTopic():
+            self.profiler.handle(msg.payload)
+            return
         devId = msg.topic.split('/')[3]
         for device in self.devices:
             if device.getID() == devId:
-                device.runCommand(msg.topic, msg.payload)
+                device.runCommand(msg.topic, msg.payload, self._commandCallback(self.tracer.begin(device)))
+
+    def _commandCallback(self, trace):
+        return lambda haDev, event, *args: self._onCommandEvent(trace, haDev, event, *args)
+
+    @dispatched
+    def _onCommandEvent(self, trace, haDev, event, *args):
+        if event == 'dispatch':
+            self.tracer.dispatched(trace)
+            if self.config('optimistic_state'):
+                self._publishOptimistic(haDev, *args)
+        elif event == 'success':
+            self.tracer.acknowledged(trace)
+        elif event == 'failure':
+            self.tracer.failed(trace, args[0] if args else None)
+            if self._clearOptimistic(haDev):
+                self._debug('Command failed, rolling back optimistic state for %s' % haDev.getID())
+                self.publishState(haDev)
+
+    def _publishOptimistic(self, haDev, cmd, value=None):
+        state = haDev.predictState(cmd, value)
+        if state is None:
+            return
+        self._clearOptimistic(haDev)
+        self.publishState(haDev, state)
+        self.optimisticTimers[haDev.getID()] = self.dispatcher.callLater(
+            self.config('optimistic_timeout') or 0, self._expireOptimistic, haDev)
+
+    def _clearOptimistic(self, haDev):
+        timer = self.optimisticTimers.pop(haDev.getID(), None)
+        self.dispatcher.cancel(timer)
+        return timer is not None
+
+    def _expireOptimistic(self, haDev):
+        if self.optimisticTimers.pop(haDev.getID(), None):
+            self._debug('Optimistic state for %s not confirmed, restoring last known state' % haDev.getID())
+            self.publishState(haDev)
+
+    def _onSlowCommand(self, trace):
+        self._debug('Slow command %s' % json.dumps(trace.toDict()))
 
     def onShutdown(self):
         # self.disconnect()
-        pass
+        # the process exits right after, wait for the worker to write the registry
+        if not self.dispatcher.call(5, self._saveRegistry):
+            logging.warning('HaClient: registry not saved at shutdown')
+
+    def _scheduleRegistrySave(self):
+        # batch registry writes, states change often and the znet stores on flash
+        if self.registry.dirty and not self.registrySaveTimer:
+            self.registrySaveTimer = self.dispatcher.callLater(300, self._saveRegistry)
+
+    def _saveRegistry(self):
+        self.dispatcher.cancel(self.registrySaveTimer)
+        self.registrySaveTimer = None
+        self.registry.save()
 
     def discover(self):
         self.discovered_flag = False
         self._debug('Discovering devices ...')
 
         self.devices = self.staticDevices + []
+        self.cache.clear()
+        self.burstFilter.clear()
         devMgr = DeviceManager(self.context)
-        for device in devMgr.retrieveDevices():
-            haDevs = devs.createDevices(device, self.hub, self._buildTopic, self.config('use_via'))
+        devices = devMgr.retrieveDevices()
+        self._recordDiscovery(devices)
+        for device in devices:
+            haDevs = self._createDevices(device)
             self._debug('Discovered %s' % json.dumps(self._debugDevice(device, haDevs)))
             for haDev in haDevs:
                 self.devices.append(haDev)
 
         self.discovered_flag = True
         self._debug('Discovered %s devices' % len(self.devices))
-        Application().queue(self.cleanupDevices)
-
-    def publishState(self, haDev):
-        states = haDev.getState()
+        self.dispatcher.post(self.cleanupDevices)
+
+    def _recordDiscovery(self, devices):
+        # replay starts from the devices and the discovery marker, written before any signal
+        if not self.recorder.isActive():
+            return
+        for device in devices:
+            self.recorder.record('device', describeDevice(device))
+        self.recorder.record('discovered', [x.id() for x in devices])
+
+    def publishState(self, haDev, states=None, onlyChanged=False):
+        states = haDev.getState() if states is None else states
+        uniqueId = haDev.getUniqueId()
+        if states is None:
+            # nothing reported since start, restore the last known state
+            states = self.registry.getState(uniqueId)
+        payloads = [str(x) for x in (states if isinstance(states, list) else [states])]
+        if onlyChanged and not self.registry.stateChanged(uniqueId, payloads[-1]):
+            return
         topic = '%s/state' % haDev.getDeviceTopic()
         self._debug('publish state for (%s) %s : %s' % (haDev.getID(), topic, states))
         if self.mqtt_connected_flag:
-            for state in (states if isinstance(states, list) else [states]):
-                self.client.publish(topic, str(state), 0, self.config('state_retain'))
-
-    def publishDevices(self):
+            for payload in payloads:
+                self.client.publish(topic, payload, 0, self.config('state_retain'))
+            self.registry.setState(uniqueId, payloads[-1])
+            self._scheduleRegistrySave()
+
+    def publishDevices(self, force=False):
+        # entities with the same config and state as in the registry are already
+        # retained on the broker, force republishes everything. Hub entity states are
+        # always published, the will sets the hub offline on every unclean drop
         for device in self.devices:
-            self.publishDevice(device)
-            self.publishState(device)
-
-    def publishDevice(self, haDev):
-        config = self._getDeviceConfig(haDev)
-        topic = '%s/config' % haDev.getDeviceTopic()
-        self._debug('publish config for (%s) %s : %s' % (haDev.getID(), topic, json.dumps(config)))
+            published = self.publishDevice(device, force)
+            self.publishState(device, onlyChanged=not published and hasattr(device, 'device'))
+        self._saveDeviceTopics()
+
+    def publishDevice(self, haDev, force=True):
+        availabilityPublished = self._trackAvailability(haDev)
+        config = json.dumps(self._getDeviceConfig(haDev))
+        uniqueId = haDev.getUniqueId()
+        devTopic = haDev.getDeviceTopic()
+        hash = configHash(config)
+        if not force and not self.registry.configChanged(uniqueId, devTopic, hash):
+            return False
+        topic = '%s/config' % devTopic
+        self._debug('publish config for (%s) %s : %s' % (haDev.getID(), topic, config))
         if self.mqtt_connected_flag:
-            self.client.publish(topic, json.dumps(config), 0, self.config('state_retain'))
-        self.setConfig('device_topics', list(set(x.getDeviceTopic() for x in self.devices)))
+            oldTopic = self.registry.getTopic(uniqueId)
+            if oldTopic and oldTopic != devTopic:
+                # entity moved, for ex. after a discovery_topic or device_name change
+                self.removeDeviceTopics(oldTopic)
+            self.client.publish(topic, config, 0, self.config('state_retain'))
+            if self.availability.isTracked(uniqueId) and not availabilityPublished:
+                self._publishAvailability(haDev)
+            self.registry.setConfig(uniqueId, devTopic, hash)
+            self._scheduleRegistrySave()
+        return True
 
     def removeDevice(self, haDev):
+        uniqueId = haDev.getUniqueId()
+        oldTopic = self.registry.getTopic(uniqueId)
+        self.registry.remove(uniqueId)
+        self.availability.untrack(uniqueId)
+        self._scheduleRegistrySave()
+        if oldTopic and oldTopic != haDev.getDeviceTopic():
+            self.removeDeviceTopics(oldTopic)
         self.removeDeviceTopics(haDev.getDeviceTopic())
+        self._saveDeviceTopics()
+
+    def _saveDeviceTopics(self):
         self.setConfig('device_topics', list(set(x.getDeviceTopic() for x in self.devices)))
 
     def removeDeviceTopics(self, devTopic):
@@ -294,6 +640,7 @@ class Client(Plugin):
             self._debug('Removing devicetopics %s/#' % devTopic)
             self.client.publish('%s/config' % devTopic, None, 0, True)
             self.client.publish('%s/state' % devTopic, None, 0, True)
+            self.client.publish('%s/availability' % devTopic, None, 0, True)
 
     def _debugDevice(self, device, haDevs):
         return {
@@ -311,62 +658,150 @@ class Client(Plugin):
         }
 
     @slot('deviceAdded')
+    @dispatched
     def onDeviceAdded(self, device):
         self._debug('Device added %s %s' % (device.id(), device.name()))
-
-        if device not in (x.device for x in self.devices if hasattr(x, 'device')):
-            haDevs = devs.createDevices(device, self.hub, self._buildTopic, self.config('use_via'))
+        if self.recorder.isActive():
+            self.recorder.record('deviceAdded', describeDevice(device))
+
+        # pairing or importing often adds many devices at once, collect them for a short
+        # while and add them as one batch
+        self.addedDevices.append(device)
+        if not self.addedTimer:
+            self.addedTimer = self.dispatcher.callLater(self.addedBatchWindow, self._processAddedDevices)
+
+    def _flushAddedDevices(self, deviceId):
+        # a signal for a device still waiting in the batch, add the batch now
+        if any(x.id() == deviceId for x in self.addedDevices):
+            self.flushAddedDevices()
+
+    @dispatched
+    def flushAddedDevices(self):
+        # process the pending batch without waiting for the window
+        if self.addedTimer:
+            self.dispatcher.cancel(self.addedTimer)
+            self._processAddedDevices()
+
+    def _processAddedDevices(self):
+        self.addedTimer = None
+        added, self.addedDevices = self.addedDevices, []
+        knownIds = set(x.device.id() for x in self.devices if hasattr(x, 'device'))
+        newDevs = []
+        for device in added:
+            if device.id() in knownIds:
+                self._debug('Device %s already exists, ignoring' % device.id())
+                continue
+            knownIds.add(device.id())
+            haDevs = self._createDevices(device)
             self._debug('New discovery %s' % json.dumps(self._debugDevice(device, haDevs)))
-            for haDev in haDevs:
-                self.devices.append(haDev)
-                self.publishDevice(haDev)
-                self.publishState(haDev)
-        else:
-            self._debug('Device already exists, ignoring')
+            newDevs.extend(haDevs)
+        if not newDevs:
+            return
+        self.devices.extend(newDevs)
+        for haDev in newDevs:
+            self.publishDevice(haDev)
+            self.publishState(haDev)
+        self._saveDeviceTopics()
 
     @slot('deviceRemoved')
+    @dispatched
     def onDeviceRemoved(self, deviceId):
         self._debug('Device removed %s' % deviceId)
+        self.recorder.record('deviceRemoved', deviceId)
+        self.addedDevices = [x for x in self.addedDevices if x.id() != deviceId]
         haDevs = [x for x in self.devices if x.deviceId == deviceId]
+        self.cache.remove(deviceId)
         for haDev in haDevs:
+            self.burstFilter.remove(haDev.getID())
             self.devices.remove(haDev)
             self.removeDevice(haDev)
 
     @slot('deviceUpdated')
+    @dispatched
     def onDeviceUpdate(self, device):
-        self._debug('Device updated %s, %s' % (device.id(), self.debugDevice(device)))
-        for haDev in [x for x in self.devices if x.deviceId == device.id()]:
-            self.publishDevice(haDev)
+        if self.recorder.isActive():
+            self.recorder.record('deviceUpdated', describeDevice(device))
+        self.cache.deviceUpdated(device)
+        self._flushAddedDevices(device.id())
+        # rebuild the entities of the device and diff against the current ones by
+        # unique_id, unchanged configs (same hash in the registry) are not republished
+        haDevs = self._createDevices(device)
+        self._debug('Device updated %s' % json.dumps(self._debugDevice(device, haDevs)))
+        oldDevs = dict((x.getUniqueId(), x) for x in self.devices
+                       if hasattr(x, 'device') and x.device.id() == device.id())
+        for haDev in haDevs:
+            oldDev = oldDevs.get(haDev.getUniqueId())
+            if getattr(oldDev, 'aggregates', None) and getattr(haDev, 'aggregates', None):
+                # keep the rolling windows
+                haDev.aggregates = oldDev.aggregates
+        newIds = set(x.getUniqueId() for x in haDevs)
+        self.devices = [x for x in self.devices if x.getUniqueId() not in oldDevs] + haDevs
+        for uniqueId, haDev in oldDevs.items():
+            if uniqueId not in newIds:
+                self.removeDevice(haDev)
+        for haDev in haDevs:
+            published = self.publishDevice(haDev, False)
+            self.publishState(haDev, onlyChanged=not published)
+        self._saveDeviceTopics()
 
     @slot('deviceStateChanged')
+    @dispatched
     def onDeviceStateChanged(self, device, state, stateValue, origin=None):
         self._debug('Device state changed (%s) state: %s value: %s origin: %s' %
                     (device.id(), state, stateValue, origin))
+        self.recorder.record('deviceStateChanged', device.id(), state, stateValue, origin)
+        self.cache.stateChanged(device)
+        self._flushAddedDevices(device.id())
+        trace = self.tracer.stateChanged(device.id())
+        self._availabilitySeen(device.id())
         haDev = next((x for x in self.devices if x.deviceId == device.id()), None)
         if haDev:
+            confirmed = self._clearOptimistic(haDev)
+            if not trace and not confirmed and self._isRepeat(haDev, (state, stateValue)):
+                return
             self.publishState(haDev)
+            self.tracer.published(trace)
         else:
             self._debug('failed to find device for state change %s' % device.id())
 
     @slot('sensorValueUpdated')
+    @dispatched
     def onSensorValueUpdated(self, device, valueType, value, scale):
         self._debug('Sensor value changed (%s) type: %s scale: %s value: %s' %
                     (device.id(), valueType, scale, value))
-        haDev = next((x for x in self.devices if hasattr(x, 'device') and x.device == device and x.sensorType ==
-                     valueType and x.sensorScale == scale), None)
+        self.recorder.record('sensorValueUpdated', device.id(), valueType, value, scale)
+        self.cache.sensorUpdated(device, valueType, value, scale)
+        self._flushAddedDevices(device.id())
+        self._availabilitySeen(device.id())
+        haDev = next((x for x in self.devices if isinstance(x, devs.HaDeviceSensor) and
+                     x.device.id() == device.id() and x.sensorType == valueType and x.sensorScale == scale), None)
+        if not haDev and self.discovered_flag:
+            # first reading of a type/scale not reported at discovery, add just this entity
+            haDev = self._createSensorDevice(device, valueType, scale)
+            self._debug('New sensor %s' % json.dumps(self._getDeviceConfig(haDev)))
+            self.devices.append(haDev)
+            self.publishDevice(haDev)
+            self._saveDeviceTopics()
         if haDev:
+            if self._isRepeat(haDev, value):
+                return
+            haDev.addSample(value)
             self.publishState(haDev)
         else:
             self._debug('failed to find device for sensor change %s %s %s' % (device.id(), valueType, scale))
 
     @slot('liveRegistered')
+    @dispatched
     def liveRegistered(self, _msg, _refReq):
+        self.recorder.record('liveRegistered')
         liveSensor = next(x for x in self.devices if isinstance(x, devs.HaLiveConnection))
         if liveSensor:
             self.publishState(liveSensor)
 
     @slot('liveDisconnected')
+    @dispatched
     def liveDisconnected(self):
+        self.recorder.record('liveDisconnected')
         liveSensor = next(x for x in self.devices if isinstance(x, devs.HaLiveConnection))
         if liveSensor:
             self.publishState(liveSensor)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import time
+
+
+class BurstFilter(object):
+    # collapses identical repeats of a signal, for ex. repeated 433 MHz frames.
+    # A repeat is dropped when it arrives within window seconds of the first
+    # identical signal of the burst, so a value reported steadily is still
+    # published once per window
+    def __init__(self):
+        self.last = {}
+
+    def accept(self, key, signature, window, now=None):
+        if not window:
+            return True
+        now = time.time() if now is None else now
+        last = self.last.get(key)
+        if last and last[0] == signature and now - last[1] < window:
+            return False
+        self.last[key] = (signature, now)
+        return True
+
+    def remove(self, key):
+        self.last.pop(key, None)
+
+    def clear(self):
+        self.last = {}
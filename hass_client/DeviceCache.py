@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import time
+
+_missing = object()
+
+
+class DeviceSnapshot(object):
+    # read-through snapshot of a telldus device, values read when building state/config are
+    # cached until a signal for the device invalidates or updates them, everything else is
+    # passed on to the device
+    def __init__(self, device):
+        self._device = device
+        self.invalidate()
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def __eq__(self, other):
+        return self._device == getattr(other, '_device', other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._device)
+
+    def invalidate(self):
+        self._state = None
+        self._stateValues = {}
+        self._sensors = None
+        self._sensorValues = None
+        self._parameters = None
+        self._methods = None
+        self._battery = _missing
+
+    def state(self):
+        if self._state is None:
+            self._state = self._device.state()
+        return self._state
+
+    def stateValue(self, stateType, default=None):
+        value = self._stateValues.get(stateType, _missing)
+        if value is _missing:
+            value = self._stateValues[stateType] = self._device.stateValue(stateType, default)
+        return value
+
+    def methods(self):
+        if self._methods is None:
+            self._methods = self._device.methods()
+        return self._methods
+
+    def battery(self):
+        if self._battery is _missing:
+            self._battery = self._device.battery()
+        return self._battery
+
+    def allParameters(self):
+        if self._parameters is None:
+            self._parameters = self._device.allParameters() if hasattr(self._device, 'allParameters') \
+                else self._device.parameters()
+        return self._parameters
+
+    def _getSensors(self):
+        if self._sensors is None:
+            self._sensors = {}
+            for type, sensors in (self._device.sensorValues() or {}).items():
+                for sensor in sensors:
+                    self._sensors[(type, sensor.get('scale', 0))] = dict(sensor)
+        return self._sensors
+
+    def sensor(self, type, scale):
+        return self._getSensors().get((type, scale))
+
+    def sensorValue(self, type, scale):
+        sensor = self.sensor(type, scale)
+        return sensor.get('value') if sensor else None
+
+    def sensorValues(self):
+        if self._sensorValues is None:
+            self._sensorValues = {}
+            for (type, _), sensor in sorted(self._getSensors().items()):
+                self._sensorValues.setdefault(type, []).append(sensor)
+        return self._sensorValues
+
+    def stateChanged(self):
+        self._state = None
+        self._stateValues = {}
+        self._battery = _missing
+
+    def sensorUpdated(self, type, value, scale):
+        sensors = self._getSensors()
+        sensor = sensors.get((type, scale))
+        if sensor is None:
+            sensor = sensors[(type, scale)] = {'scale': scale}
+            self._sensorValues = None
+        sensor.update({'value': value, 'lastUpdated': int(time.time())})
+        self._battery = _missing
+
+
+class DeviceCache(object):
+    def __init__(self):
+        self.snapshots = {}
+
+    def get(self, device):
+        if isinstance(device, DeviceSnapshot):
+            return device
+        snapshot = self.snapshots.get(device.id())
+        if snapshot is None or snapshot._device is not device:
+            snapshot = self.snapshots[device.id()] = DeviceSnapshot(device)
+        return snapshot
+
+    def clear(self):
+        self.snapshots = {}
+
+    def remove(self, deviceId):
+        self.snapshots.pop(deviceId, None)
+
+    def stateChanged(self, device):
+        snapshot = self.snapshots.get(device.id())
+        if snapshot:
+            snapshot.stateChanged()
+
+    def sensorUpdated(self, device, type, value, scale):
+        snapshot = self.snapshots.get(device.id())
+        if snapshot:
+            snapshot.sensorUpdated(type, value, scale)
+
+    def deviceUpdated(self, device):
+        snapshot = self.snapshots.get(device.id())
+        if snapshot:
+            snapshot.invalidate()
@@ -1,5 +1,6 @@
+from Aggregates import SensorAggregates
 from board import Board  # type: ignore
-from utils import getIpAddr, getMacAddr, sensorScaleIntToStr, sensorTypeIntToStr, sensorTypeIntToDeviceClass, sensorTypeIntToStateClass, slugify
+from utils import getIpAddr, getMacAddr, sensorMetadata, sensorScaleIntToStr, slugify
 from telldus import Device, Thermostat  # type: ignore
 import json
 import logging
@@ -9,6 +10,9 @@ origin = 'HaClient'
 
 
 class HaBaseDevice(object):
+    # seconds within which identical repeated signals are collapsed into one publish
+    dedupWindow = 0
+
     def __init__(self, deviceId, deviceName, deviceType, buildTopic, viaDevice=None, category=None):
         self.deviceId = deviceId
         self.deviceName = deviceName
@@ -17,16 +21,28 @@ class HaBaseDevice(object):
         self.viaDevice = viaDevice
         self.category = category
 
-    def _deviceCommand(self, device, cmd, **kwargs):
+    def _deviceCommand(self, device, cmd, callback=None, **kwargs):
+        # callback(haDev, event, *args) is notified on 'dispatch', 'success' and 'failure'
         logging.info('DeviceCommand CMD: %s, ARGS: %s' % (cmd, kwargs))
 
+        def cmdSuccess(*__args, **__kwargs):
+            if callback:
+                callback(self, 'success')
+
         def cmdFail(reason, **__kwargs):
             logging.info('Command failed: %s' % reason)
-        device.command(cmd, origin=origin, failure=cmdFail, **kwargs)
+            if callback:
+                callback(self, 'failure', reason)
+        if callback:
+            callback(self, 'dispatch', cmd, kwargs.get('value'))
+        device.command(cmd, origin=origin, success=cmdSuccess, failure=cmdFail, **kwargs)
 
     def getID(self):
         return '%s' % self.deviceId
 
+    def getUniqueId(self):
+        return '%s_%s' % (getMacAddr(True), self.getID())
+
     def getName(self):
         return self.deviceName
 
@@ -39,10 +55,18 @@ class HaBaseDevice(object):
     def getState(self):
         return None
 
+    def lastUpdated(self):
+        # timestamp of the last value reported before start, if the device keeps one
+        return None
+
+    def predictState(self, cmd, value=None):
+        # state expected after a successful command, None when it can not be predicted
+        return None
+
     def getConfig(self):
         conf = {
             'name': self.getName(),
-            'unique_id': '%s_%s' % (getMacAddr(True), self.getID()),
+            'unique_id': self.getUniqueId(),
             'state_topic': '%s/state' % self.getDeviceTopic(),
         }
         if hasattr(self, 'runCommand'):
@@ -135,10 +159,16 @@ class HaHubConnectivitySensor(HaHubDevice):
 
 
 class HaTimedSensor(HaBaseDevice):
-    pass
+    # seconds between polls, None for entities that are only published on change.
+    # Polls returning the same value back off up to maxInterval
+    interval = 30
+    maxInterval = None
 
 
 class HaLiveConnection(HaHubConnectivitySensor, HaTimedSensor):
+    # published from the liveRegistered/liveDisconnected slots
+    interval = None
+
     def __init__(self, hub, live, buildTopic):
         super(HaLiveConnection, self).__init__(hub, 'live', 'Telldus live', buildTopic, None, 'diagnostic')
         self.live = live
@@ -148,6 +178,9 @@ class HaLiveConnection(HaHubConnectivitySensor, HaTimedSensor):
 
 
 class HaIpAddr(HaHubSensor, HaTimedSensor):
+    interval = 600
+    maxInterval = 3600
+
     def __init__(self, hub, buildTopic):
         super(HaIpAddr, self).__init__(hub, 'ipaddr', 'IP address', buildTopic, None, 'diagnostic', None)
 
@@ -156,14 +189,21 @@ class HaIpAddr(HaHubSensor, HaTimedSensor):
 
 
 class HaCpu(HaHubSensor, HaTimedSensor):
+    interval = 15
+    maxInterval = 120
+
     def __init__(self, hub, buildTopic):
         super(HaCpu, self).__init__(hub, 'cpu', 'Cpu usage', buildTopic, None, 'diagnostic', '%')
 
     def getState(self):
-        return psutil.cpu_percent(1)
+        # usage since the previous poll, does not block the dispatcher
+        return psutil.cpu_percent(None)
 
 
 class HaRamFree(HaHubSensor, HaTimedSensor):
+    interval = 60
+    maxInterval = 600
+
     def __init__(self, hub, buildTopic):
         super(HaRamFree, self).__init__(hub, 'ram_free', 'Free ram', buildTopic, None, None, '%')
 
@@ -172,6 +212,9 @@ class HaRamFree(HaHubSensor, HaTimedSensor):
 
 
 class HaNetIOSent(HaHubSensor, HaTimedSensor):
+    interval = 60
+    maxInterval = 600
+
     def __init__(self, hub, buildTopic):
         super(HaNetIOSent, self).__init__(hub, 'net_sent', 'Network sent bytes', buildTopic, None, None, 'Mb')
 
@@ -185,6 +228,9 @@ class HaNetIOSent(HaHubSensor, HaTimedSensor):
 
 
 class HaNetIORecv(HaHubSensor, HaTimedSensor):
+    interval = 60
+    maxInterval = 600
+
     def __init__(self, hub, buildTopic):
         super(HaNetIORecv, self).__init__(hub, 'net_recv', 'Network recv bytes', buildTopic, None, None, 'Mb')
 
@@ -197,42 +243,89 @@ class HaNetIORecv(HaHubSensor, HaTimedSensor):
         return conf
 
 
+class HaCommandLatency(HaHubSensor, HaTimedSensor):
+    interval = 60
+    maxInterval = 600
+
+    def __init__(self, hub, buildTopic, tracer, entityType):
+        super(HaCommandLatency, self).__init__(hub, 'latency_%s' % entityType, '%s command latency' % entityType.title(),
+                                               buildTopic, None, 'diagnostic', 'ms')
+        self.tracer = tracer
+        self.entityType = entityType
+
+    def getState(self):
+        state = self.tracer.getStats(self.entityType)
+        # recent slow commands, shown as attributes
+        state['slow'] = self.tracer.getSlow(self.entityType)
+        return json.dumps(state)
+
+    def getConfig(self):
+        conf = super(HaCommandLatency, self).getConfig()
+        conf.update({
+            'value_template': '{{ value_json.p90 }}',
+            'json_attributes_topic': '%s/state' % self.getDeviceTopic()
+        })
+        return conf
+
+
 class HaDeviceSensor(HaHubSensor):
-    def __init__(self, hub, device, sensorType, sensorScale, buildTopic, viaDevice=None, category=None, unit=None):
+    dedupWindow = 2
+
+    def __init__(self, hub, device, sensorType, sensorScale, buildTopic, viaDevice=None, category=None, unit=None,
+                 aggregateWindows=None):
         super(HaDeviceSensor, self).__init__(
             hub,
             '%s_%s_%s' % (device.id(), sensorType, sensorScale),
-            '%s %s' % (device.name(), sensorTypeIntToStr(sensorType, sensorScale)),
+            '%s %s' % (device.name(), sensorMetadata(sensorType, sensorScale).name),
             buildTopic,
             viaDevice=viaDevice,
             category=category,
-            unit=unit or sensorScaleIntToStr(sensorType, sensorScale)
+            unit=unit or sensorMetadata(sensorType, sensorScale).unit
         )
         self.device = device
         self.sensorType = sensorType
         self.sensorScale = sensorScale
+        self.aggregates = SensorAggregates(aggregateWindows) if aggregateWindows else None
+
+    def addSample(self, value):
+        if self.aggregates:
+            self.aggregates.add(value)
+
+    def lastUpdated(self):
+        sensor = self.device.sensor(self.sensorType, self.sensorScale)
+        return sensor.get('lastUpdated') if sensor else None
 
     def getState(self):
-        sensor = next((x for x in self.device.sensorValues()[self.sensorType] if x['scale'] == self.sensorScale), None)
+        sensor = self.device.sensor(self.sensorType, self.sensorScale)
         if sensor:
-            return json.dumps({
+            state = {
                 'value': sensor.get('value', None),
                 'lastUpdated': sensor.get('lastUpdated', None)
-            })
+            }
+            if self.aggregates:
+                state.update({'stats': self.aggregates.getStats()})
+            return json.dumps(state)
 
     def getConfig(self):
         conf = super(HaDeviceSensor, self).getConfig()
+        meta = sensorMetadata(self.sensorType, self.sensorScale)
         conf.update({
-            'state_class': sensorTypeIntToStateClass(self.sensorType, self.sensorScale),
+            'state_class': meta.state_class,
             'value_template': '{{ value_json.value }}'
         })
-        devClass = sensorTypeIntToDeviceClass(self.sensorType, self.sensorScale)
-        if devClass:
-            conf.update({'device_class': devClass})
+        if meta.device_class:
+            conf.update({'device_class': meta.device_class})
+        if self.aggregates:
+            conf.update({
+                'json_attributes_topic': '%s/state' % self.getDeviceTopic(),
+                'json_attributes_template': '{{ value_json.stats | tojson }}'
+            })
         return conf
 
 
 class HaDeviceBinary(HaHubDevice):
+    dedupWindow = 1
+
     def __init__(self, hub, device, buildTopic, viaDevice=None, category=None):
         super(HaDeviceBinary, self).__init__(hub, device.id(), device.name(),
                                              'binary_sensor', buildTopic, viaDevice=viaDevice, category=category)
@@ -250,7 +343,12 @@ class HaDeviceSwitch(HaHubDevice):
         self.device = device
 
     def getState(self):
-        state, stateValue = self.device.state()
+        return self._stateToPayload(*self.device.state())
+
+    def predictState(self, cmd, value=None):
+        return self._stateToPayload(cmd, value)
+
+    def _stateToPayload(self, state, stateValue):
         result = 'ON' if state in [Device.TURNON, Device.BELL] else 'OFF'
         if state == Device.BELL:
             return [result, 'OFF']
@@ -262,12 +360,13 @@ class HaDeviceSwitch(HaHubDevice):
             conf.update({'payload_on': 'BELL'})
         return conf
 
-    def runCommand(self, topic, payload):
+    def runCommand(self, topic, payload, callback=None):
         self._deviceCommand(
             self.device,
             Device.TURNON if payload.upper() == 'ON'
             else Device.BELL if payload.upper() == 'BELL'
-            else Device.TURNOFF
+            else Device.TURNOFF,
+            callback
         )
 
 
@@ -278,7 +377,12 @@ class HaDeviceLight(HaHubDevice):
         self.device = device
 
     def getState(self):
-        state, stateValue = self.device.state()
+        return self._stateToPayload(*self.device.state())
+
+    def predictState(self, cmd, value=None):
+        return self._stateToPayload(cmd, value)
+
+    def _stateToPayload(self, state, stateValue):
         if state == Device.DIM:
             return json.dumps({
                 'state': 'ON' if stateValue and int(stateValue) > 0 else 'OFF',
@@ -298,18 +402,19 @@ class HaDeviceLight(HaHubDevice):
         })
         return conf
 
-    def runCommand(self, topic, payload):
+    def runCommand(self, topic, payload, callback=None):
         command = json.loads(payload)
         if 'brightness' in command:
             if int(command['brightness']) == 0:
-                self._deviceCommand(self.device, Device.TURNOFF)
+                self._deviceCommand(self.device, Device.TURNOFF, callback)
             else:
-                self._deviceCommand(self.device, Device.DIM, value=int(command['brightness']))
+                self._deviceCommand(self.device, Device.DIM, callback, value=int(command['brightness']))
         else:
             self._deviceCommand(
                 self.device,
                 Device.TURNON if command['state'].upper() == 'ON'
                 else Device.TURNOFF,
+                callback,
                 value=255
             )
 
@@ -339,6 +444,14 @@ class HaDeviceCover(HaHubDevice):
                    'closed' if state == Device.DOWN else \
                    'stopped'
 
+    def predictState(self, cmd, value=None):
+        if self.device.methods() & Device.DIM:
+            # up/down/stop on a positional cover does not tell the resulting position
+            return int(value) if cmd == Device.DIM and value is not None else None
+        return 'open' if cmd == Device.UP else \
+               'closed' if cmd == Device.DOWN else \
+               None
+
     def getConfig(self):
         conf = super(HaDeviceCover, self).getConfig()
         if self.device.methods() & Device.DIM:
@@ -350,16 +463,17 @@ class HaDeviceCover(HaHubDevice):
             })
         return conf
 
-    def runCommand(self, topic, payload):
+    def runCommand(self, topic, payload, callback=None):
         topicType = topic.split('/')[-1].upper()
         if topicType == 'POS':
-            self._deviceCommand(self.device, Device.DIM, value=int(payload))
+            self._deviceCommand(self.device, Device.DIM, callback, value=int(payload))
         elif topicType == 'SET':
             self._deviceCommand(
                 self.device,
                 Device.UP if payload.upper() == 'OPEN'
                 else Device.DOWN if payload.upper() == 'CLOSE' else
-                Device.STOP
+                Device.STOP,
+                callback
             )
 
 
@@ -370,8 +484,7 @@ class HaDeviceClimate(HaHubDevice):
         self.device = device
 
     def _getThermostat(self):
-        params = self.device.allParameters() if hasattr(self.device, 'allParameters') else self.device.parameters()
-        return params.get('thermostat', {})
+        return self.device.allParameters().get('thermostat', {})
 
     def _getModes(self):
         return self._getThermostat().get('modes', [])
@@ -415,31 +528,31 @@ class HaDeviceClimate(HaHubDevice):
 
         if self.device.isSensor():
             sensorValues = self.device.sensorValues().get(Device.TEMPERATURE, [])
-            tempValue = next(sensorValues, None)
+            tempValue = next(iter(sensorValues), None)
             if tempValue:
                 conf.update({
                     'current_temperature_topic': '%s/state' % self.getDeviceTopic(),
                     'current_temperature_template': '{{ value_json.temperature }}',
-                    'unit_of_measurement': sensorScaleIntToStr(Device.TEMPERATURE, tempValue.scale) or ''
+                    'unit_of_measurement': sensorScaleIntToStr(Device.TEMPERATURE, tempValue.get('scale', 0)) or ''
                 })
 
         return conf
 
-    def runCommand(self, topic, payload):
+    def runCommand(self, topic, payload, callback=None):
         topicType = topic.split('/')[-1].upper()
         if topicType == 'SETMODE':
             value = {
                 'mode': payload,
                 'changeMode': True,
             }
-            self._deviceCommand(self.device, Device.THERMOSTAT, value=value)
+            self._deviceCommand(self.device, Device.THERMOSTAT, callback, value=value)
         elif topicType == 'SETPOINT':
             setpoint = float(payload) if payload else None
             value = {
                 'changeMode': False,
                 'temperature': setpoint
             }
-            self._deviceCommand(self.device, Device.THERMOSTAT, value=value)
+            self._deviceCommand(self.device, Device.THERMOSTAT, callback, value=value)
 
 
 class HaDeviceBattery(HaHubSensor):
@@ -462,13 +575,8 @@ class HaDeviceBattery(HaHubSensor):
         return conf
 
 
-def createDevices(device, hub, buildTopic, createSubDevices=False):
-    caps = device.methods()
-    devType = device.allParameters().get('devicetype')
-
-    result = []
-
-    subDevice = {
+def createSubDevice(device, hub):
+    return {
         'identifiers': device.getOrCreateUUID(),
         # 'connections': [['mac', getMacAddr(False)]],
         'manufacturer': device.protocol().title(),
@@ -476,7 +584,23 @@ def createDevices(device, hub, buildTopic, createSubDevices=False):
         'name': device.name(),
         'suggested_area': device.room() or '',
         'via_device': hub.getConfig().get('device', {}).get('identifiers', '')
-    } if createSubDevices else None
+    }
+
+
+def createSensorDevice(device, hub, buildTopic, sensorType, sensorScale, createSubDevices=False, aggregateWindows=None):
+    # a single sensor entity, for sensor types/scales first reported after discovery
+    subDevice = createSubDevice(device, hub) if createSubDevices else None
+    return HaDeviceSensor(hub, device, sensorType, sensorScale, buildTopic, subDevice,
+                          aggregateWindows=aggregateWindows)
+
+
+def createDevices(device, hub, buildTopic, createSubDevices=False, aggregateWindows=None):
+    caps = device.methods()
+    devType = device.allParameters().get('devicetype')
+
+    result = []
+
+    subDevice = createSubDevice(device, hub) if createSubDevices else None
 
     if device.battery() and device.battery() != Device.BATTERY_UNKNOWN:
         result.append(HaDeviceBattery(hub, device, buildTopic, subDevice))
@@ -484,7 +608,8 @@ def createDevices(device, hub, buildTopic, createSubDevices=False):
     if device.isSensor():
         for type, sensors in device.sensorValues().items():
             for sensor in sensors:
-                result.append(HaDeviceSensor(hub, device, type, sensor.get('scale', 0), buildTopic, subDevice))
+                result.append(HaDeviceSensor(hub, device, type, sensor.get('scale', 0), buildTopic, subDevice,
+                                             aggregateWindows=aggregateWindows))
 
     if device.isDevice():
         if devType == Device.TYPE_THERMOSTAT:
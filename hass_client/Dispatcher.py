@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from functools import wraps
+import heapq
+import logging
+import threading
+import time
+
+try:
+    from Queue import Empty, Queue  # type: ignore
+except ImportError:
+    from queue import Empty, Queue  # type: ignore
+
+
+class Dispatcher(object):
+    # owns all plugin state, mqtt callbacks, telldus signals and timers are queued
+    # as events and executed in order on a single worker thread
+    def __init__(self, name='HaDispatcher'):
+        self.name = name
+        self.events = Queue()
+        self.timers = []
+        self.timerSeq = 0
+        self.timerLock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.stopped = False
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.running = True
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.stopped = True
+        self.events.put(None)
+
+    def isOwner(self):
+        return threading.current_thread() is self.thread
+
+    def post(self, fn, *args, **kwargs):
+        if self.stopped:
+            # nothing will run it
+            return
+        self.events.put((fn, args, kwargs))
+
+    def call(self, timeout, fn, *args, **kwargs):
+        # run fn on the worker and wait up to timeout seconds for it to finish,
+        # inline when already on the worker or when the worker is gone
+        if self.isOwner() or not (self.thread and self.thread.is_alive()):
+            self._execute(fn, args, kwargs)
+            return True
+        done = threading.Event()
+
+        def run():
+            try:
+                fn(*args, **kwargs)
+            finally:
+                done.set()
+        self.post(run)
+        return done.wait(timeout)
+
+    def callLater(self, delay, fn, *args, **kwargs):
+        # returns a handle that can be passed to cancel
+        with self.timerLock:
+            timer = [time.time() + max(delay, 0), self.timerSeq, fn, args, kwargs]
+            self.timerSeq += 1
+            heapq.heappush(self.timers, timer)
+        if not self.isOwner() and not self.stopped:
+            # wake the worker so it picks up the new deadline
+            self.events.put(None)
+        return timer
+
+    def cancel(self, timer):
+        if timer:
+            timer[2] = None
+
+    def join(self):
+        # wait for all queued events to be processed, returns directly once stopped
+        if self.stopped and not (self.thread and self.thread.is_alive()):
+            self._drain()
+            return
+        self.events.join()
+
+    def _drain(self):
+        # mark whatever is left in the queue done, including the stop sentinel
+        while True:
+            try:
+                self.events.get_nowait()
+            except Empty:
+                return
+            self.events.task_done()
+
+    def _nextTimeout(self):
+        with self.timerLock:
+            while self.timers and self.timers[0][2] is None:
+                heapq.heappop(self.timers)
+            return max(self.timers[0][0] - time.time(), 0) if self.timers else None
+
+    def _runTimers(self):
+        now = time.time()
+        while True:
+            with self.timerLock:
+                if not self.timers or self.timers[0][0] > now:
+                    return
+                _, _, fn, args, kwargs = heapq.heappop(self.timers)
+            if fn:
+                self._execute(fn, args, kwargs)
+
+    def _execute(self, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logging.exception('HaDispatcher: event %s failed', getattr(fn, '__name__', fn))
+
+    def _run(self):
+        while self.running:
+            timeout = self._nextTimeout()
+            event, received = None, False
+            if timeout is None or timeout > 0:
+                try:
+                    event, received = self.events.get(True, timeout), True
+                except Empty:
+                    pass
+            self._runTimers()
+            if event:
+                fn, args, kwargs = event
+                self._execute(fn, args, kwargs)
+            if received:
+                self.events.task_done()
+        self._drain()
+
+
+def dispatched(fn):
+    # run the method on the instance dispatcher, inline when already on the worker thread
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if self.dispatcher.isOwner():
+            return fn(self, *args, **kwargs)
+        self.dispatcher.post(fn, self, *args, **kwargs)
+    return wrapper
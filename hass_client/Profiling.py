@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from StringIO import StringIO  # type: ignore
+except ImportError:
+    from io import StringIO  # type: ignore
+
+try:
+    import tracemalloc  # type: ignore
+except ImportError:
+    # python < 3.4
+    tracemalloc = None
+
+
+def _frameName(frame):
+    code = frame.f_code
+    return '%s:%s(%s)' % (os.path.basename(code.co_filename), frame.f_lineno, code.co_name)
+
+
+class Profiler(object):
+    # on demand profiling controlled from mqtt, nothing is hooked until a command arrives.
+    # Commands are json {"action": ..., "seconds": N} or just the action:
+    #   profile     deterministic profile (cProfile) of the dispatcher thread
+    #   sample      statistical sampling of all threads
+    #   stop        stop a running profile/sample early
+    #   mem_start   start tracemalloc and take a baseline snapshot
+    #   mem_diff    take a snapshot and report the growth since the previous one
+    #   mem_stop    stop tracemalloc
+    def __init__(self, dispatcher, report, outputDir=None, top=15):
+        self.dispatcher = dispatcher
+        self.report = report
+        self.outputDir = outputDir or tempfile.gettempdir()
+        self.top = top
+        self.profile = None
+        self.profileTimer = None
+        self.sampling = None
+        self.memSnapshot = None
+
+    def handle(self, payload):
+        if isinstance(payload, bytes) and not isinstance(payload, str):
+            payload = payload.decode('utf-8', 'replace')
+        try:
+            command = json.loads(payload)
+        except ValueError:
+            command = {'action': payload}
+        if not isinstance(command, dict):
+            command = {'action': str(command)}
+        action = str(command.get('action', '')).strip().lower()
+        try:
+            seconds = min(max(float(command.get('seconds', 10)), 0.1), 3600)
+        except (TypeError, ValueError):
+            seconds = 10
+        if action == 'profile':
+            self.startProfile(seconds)
+        elif action == 'sample':
+            self.startSampling(seconds, float(command.get('interval', 0.01)))
+        elif action == 'stop':
+            self.stopProfile()
+            self.stopSampling()
+        elif action == 'mem_start':
+            self.memStart()
+        elif action == 'mem_diff':
+            self.memDiff()
+        elif action == 'mem_stop':
+            self.memStop()
+        else:
+            self.report('Profiler: unknown action %s' % action)
+
+    def _outputPath(self, kind, ext):
+        return os.path.join(self.outputDir, 'hass_client_%s_%s.%s' % (kind, time.strftime('%Y%m%d_%H%M%S'), ext))
+
+    def startProfile(self, seconds):
+        # must be called on the dispatcher thread, cProfile only follows the enabling thread
+        if self.profile:
+            self.report('Profiler: profile already running')
+            return
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.profileTimer = self.dispatcher.callLater(seconds, self.stopProfile)
+        self.report('Profiler: profiling dispatcher for %s s' % seconds)
+
+    def stopProfile(self):
+        if not self.profile:
+            return
+        profile, self.profile = self.profile, None
+        profile.disable()
+        self.dispatcher.cancel(self.profileTimer)
+        self.profileTimer = None
+        path = self._outputPath('profile', 'prof')
+        try:
+            profile.dump_stats(path)
+        except (IOError, OSError) as e:
+            path = 'not saved (%s)' % e
+        stream = StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(self.top)
+        self.report('Profiler: profile written to %s\n%s' % (path, stream.getvalue()))
+
+    def startSampling(self, seconds, interval):
+        if self.sampling:
+            self.report('Profiler: sampling already running')
+            return
+        self.sampling = threading.Event()
+        thread = threading.Thread(target=self._sample, args=(self.sampling, seconds, max(interval, 0.001)),
+                                  name='HaProfiler')
+        thread.daemon = True
+        thread.start()
+        self.report('Profiler: sampling all threads for %s s' % seconds)
+
+    def stopSampling(self):
+        if self.sampling:
+            self.sampling.set()
+
+    def _sample(self, stopped, seconds, interval):
+        own = threading.current_thread().ident
+        stacks = {}
+        selfCounts = {}
+        samples = 0
+        end = time.time() + seconds
+        while time.time() < end and not stopped.is_set():
+            names = dict((x.ident, x.name) for x in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frameName(frame))
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                selfCounts[stack[0]] = selfCounts.get(stack[0], 0) + 1
+                key = ';'.join([names.get(ident, str(ident))] + stack[::-1])
+                stacks[key] = stacks.get(key, 0) + 1
+            samples += 1
+            time.sleep(interval)
+        # collapsed stack format, usable with flamegraph tools
+        path = self._outputPath('sample', 'txt')
+        try:
+            with open(path, 'w') as f:
+                for key, count in sorted(stacks.items()):
+                    f.write('%s %s\n' % (key, count))
+        except (IOError, OSError) as e:
+            path = 'not saved (%s)' % e
+        topFunctions = sorted(selfCounts.items(), key=lambda x: x[1], reverse=True)[:self.top]
+        self.dispatcher.post(self._finishSampling, path, samples, topFunctions)
+
+    def _finishSampling(self, path, samples, topFunctions):
+        self.sampling = None
+        lines = ['%6d  %s' % (count, name) for name, count in topFunctions]
+        self.report('Profiler: %s samples written to %s, top functions:\n%s' % (samples, path, '\n'.join(lines)))
+
+    def memStart(self):
+        if not tracemalloc:
+            self.report('Profiler: tracemalloc is not available in this python')
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        self.memSnapshot = tracemalloc.take_snapshot()
+        self.report('Profiler: tracemalloc started')
+
+    def memDiff(self):
+        if not tracemalloc or not tracemalloc.is_tracing():
+            self.report('Profiler: tracemalloc is not running, send mem_start first')
+            return
+        snapshot = tracemalloc.take_snapshot()
+        path = self._outputPath('malloc', 'snapshot')
+        try:
+            snapshot.dump(path)
+        except (IOError, OSError) as e:
+            path = 'not saved (%s)' % e
+        stats = snapshot.compare_to(self.memSnapshot, 'lineno') if self.memSnapshot else \
+            snapshot.statistics('lineno')
+        self.memSnapshot = snapshot
+        lines = [str(x) for x in stats[:self.top]]
+        self.report('Profiler: snapshot written to %s, top allocation sites:\n%s' % (path, '\n'.join(lines)))
+
+    def memStop(self):
+        if tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memSnapshot = None
+        self.report('Profiler: tracemalloc stopped')
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from telldus import Device  # type: ignore
+import json
+import logging
+import time
+
+
+def describeDevice(device):
+    # everything needed to recreate a stand-in of the device when replaying
+    return {
+        'id': device.id(),
+        'name': device.name(),
+        'isDevice': device.isDevice(),
+        'isSensor': device.isSensor(),
+        'methods': device.methods(),
+        'battery': device.battery(),
+        'parameters': device.allParameters() if hasattr(device, 'allParameters') else device.parameters(),
+        'typeStr': device.typeString(),
+        'sensors': device.sensorValues(),
+        'state': device.state(),
+        'uuid': device.getOrCreateUUID(),
+        'protocol': device.protocol(),
+        'model': device.model(),
+        'room': device.room()
+    }
+
+
+class Recorder(object):
+    # append-only event log, one compact json array per line: [time, kind, args...]
+    def __init__(self):
+        self.path = None
+        self.file = None
+
+    def isActive(self):
+        return self.file is not None
+
+    def open(self, path):
+        self.close()
+        if not path:
+            return
+        try:
+            self.file = open(path, 'a')
+        except (IOError, OSError) as e:
+            logging.warning('HaClient: failed to open record file %s: %s', path, e)
+            return
+        self.path = path
+        constants = dict((x, getattr(Device, x)) for x in dir(Device) if x.isupper())
+        self.record('header', {'constants': constants})
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.path = None
+
+    def record(self, kind, *args):
+        if not self.file:
+            return
+        try:
+            self.file.write(json.dumps([round(time.time(), 3), kind] + list(args), separators=(',', ':'), default=str))
+            self.file.write('\n')
+            self.file.flush()
+        except (IOError, OSError, TypeError, ValueError) as e:
+            logging.warning('HaClient: failed to record %s: %s', kind, e)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+
+
+def configHash(payload):
+    return hashlib.sha1(payload.encode('utf-8') if not isinstance(payload, bytes) else payload).hexdigest()[:16]
+
+
+class EntityRegistry(object):
+    # unique_id -> {'t': topic, 'h': config hash, 's': last published state}, kept in
+    # one compact json file that is read once at startup and rewritten atomically
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.loads(f.read())
+            self.entries = entries if isinstance(entries, dict) else {}
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+        self.dirty = False
+        return len(self.entries)
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmpPath = '%s.tmp' % self.path
+        try:
+            with open(tmpPath, 'w') as f:
+                f.write(json.dumps(self.entries, separators=(',', ':')))
+            os.rename(tmpPath, self.path)
+            self.dirty = False
+        except (IOError, OSError) as e:
+            logging.warning('HaClient: failed to save registry %s: %s', self.path, e)
+
+    def uniqueIds(self):
+        return set(self.entries.keys())
+
+    def getTopic(self, uniqueId):
+        return self.entries.get(uniqueId, {}).get('t')
+
+    def getState(self, uniqueId):
+        return self.entries.get(uniqueId, {}).get('s')
+
+    def configChanged(self, uniqueId, topic, hash):
+        entry = self.entries.get(uniqueId)
+        return not entry or entry.get('t') != topic or entry.get('h') != hash
+
+    def setConfig(self, uniqueId, topic, hash):
+        entry = self.entries.setdefault(uniqueId, {})
+        if entry.get('t') != topic or entry.get('h') != hash:
+            entry.update({'t': topic, 'h': hash})
+            self.dirty = True
+
+    def stateChanged(self, uniqueId, state):
+        entry = self.entries.get(uniqueId)
+        return not entry or entry.get('s') != state
+
+    def setState(self, uniqueId, state):
+        entry = self.entries.setdefault(uniqueId, {})
+        if entry.get('s') != state:
+            entry['s'] = state
+            self.dirty = True
+
+    def remove(self, uniqueId):
+        if self.entries.pop(uniqueId, None) is not None:
+            self.dirty = True
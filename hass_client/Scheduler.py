@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import random
+
+
+class _Entry(object):
+    def __init__(self, haDev):
+        self.haDev = haDev
+        self.delay = haDev.interval
+        self.lastState = None
+        self.timer = None
+
+
+class TimedScheduler(object):
+    # each timed entity gets its own timer on the dispatcher heap. Values are only
+    # published when changed, a stable value doubles the delay up to maxInterval and
+    # a change resets it to the entity interval
+    def __init__(self, dispatcher, publish, jitter=0.1):
+        self.dispatcher = dispatcher
+        self.publish = publish
+        self.jitter = jitter
+        self.entries = {}
+
+    def add(self, haDev):
+        if not haDev.interval or haDev.getID() in self.entries:
+            return
+        entry = self.entries[haDev.getID()] = _Entry(haDev)
+        # spread the first run over the interval to avoid a burst at startup
+        self._schedule(entry, random.uniform(0, haDev.interval))
+
+    def clear(self):
+        for entry in self.entries.values():
+            self.dispatcher.cancel(entry.timer)
+        self.entries = {}
+
+    def _schedule(self, entry, delay):
+        entry.timer = self.dispatcher.callLater(delay, self._run, entry)
+
+    def _run(self, entry):
+        haDev = entry.haDev
+        try:
+            state = haDev.getState()
+            if state != entry.lastState:
+                entry.lastState = state
+                entry.delay = haDev.interval
+                self.publish(haDev, state)
+            else:
+                entry.delay = min(entry.delay * 2, haDev.maxInterval or haDev.interval)
+        finally:
+            if self.entries.get(haDev.getID()) is entry:
+                self._schedule(entry, entry.delay * random.uniform(1 - self.jitter, 1 + self.jitter))
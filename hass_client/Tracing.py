@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+import itertools
+import time
+
+# points of a command trace, in order
+POINTS = ['received', 'dispatch', 'ack', 'state', 'published']
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100.0), len(values) - 1)]
+
+
+class CommandTrace(object):
+    def __init__(self, traceId, entityType, deviceId):
+        self.id = traceId
+        self.entityType = entityType
+        self.deviceId = deviceId
+        self.times = {'received': time.time()}
+        self.result = None
+
+    def mark(self, point):
+        self.times.setdefault(point, time.time())
+
+    def total(self):
+        return max(self.times.values()) - self.times['received']
+
+    def toDict(self):
+        received = self.times['received']
+        result = {
+            'id': self.id,
+            'type': self.entityType,
+            'device': self.deviceId,
+            'result': self.result
+        }
+        result.update(dict(
+            (point, int((self.times[point] - received) * 1000)) for point in POINTS[1:] if point in self.times
+        ))
+        return result
+
+
+class CommandTracer(object):
+    # follows a command from the mqtt set message to the published state change and
+    # keeps the latest latencies per entity type
+    def __init__(self, slowThreshold=2.0, timeout=30, samples=200, slowLogSize=20):
+        self.slowThreshold = slowThreshold
+        self.timeout = timeout
+        self.samples = samples
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.latencies = {}
+        self.slowLog = deque(maxlen=slowLogSize)
+        self.onSlow = None
+
+    def begin(self, haDev):
+        self.expire()
+        return CommandTrace(next(self.ids), haDev.getType(), haDev.deviceId)
+
+    def dispatched(self, trace):
+        trace.mark('dispatch')
+        self.pending[trace.deviceId] = trace
+
+    def acknowledged(self, trace):
+        trace.mark('ack')
+
+    def failed(self, trace, reason):
+        trace.mark('ack')
+        if self.pending.get(trace.deviceId) is trace:
+            del self.pending[trace.deviceId]
+        self._finish(trace, 'failed: %s' % reason)
+
+    def stateChanged(self, deviceId):
+        trace = self.pending.pop(deviceId, None)
+        if trace:
+            trace.mark('state')
+        return trace
+
+    def published(self, trace):
+        if trace:
+            trace.mark('published')
+            self._finish(trace, 'ok')
+
+    def expire(self):
+        limit = time.time() - self.timeout
+        for deviceId, trace in list(self.pending.items()):
+            if trace.times['received'] < limit:
+                del self.pending[deviceId]
+                self._finish(trace, 'unconfirmed')
+
+    def _finish(self, trace, result):
+        trace.result = result
+        if result == 'ok':
+            self.latencies.setdefault(trace.entityType, deque(maxlen=self.samples)).append(trace.total())
+        if result != 'ok' or trace.total() > self.slowThreshold:
+            self.slowLog.append(trace.toDict())
+            if self.onSlow:
+                self.onSlow(trace)
+
+    def getStats(self, entityType):
+        self.expire()
+        values = self.latencies.get(entityType, [])
+        return dict(
+            [('p%s' % x, int(percentile(values, x) * 1000) if values else 0) for x in (50, 90, 99)] +
+            [('count', len(values))]
+        )
+
+    def getSlow(self, entityType, limit=5):
+        # latest slow or failed traces of the type, oldest first
+        return [x for x in self.slowLog if x['type'] == entityType][-limit:]
@@ -1,3 +1,6 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+import os
 from time import gmtime, strftime
 import netifaces  # type: ignore
 from board import Board  # type: ignore
@@ -22,121 +25,143 @@ def getIpAddr():
     return inet.get('addr', '')
 
 
+def dataDir():
+    # writable directory kept across plugin upgrades, the plugin directory is replaced
+    try:
+        base = Board.configDir()
+    except AttributeError:
+        base = os.path.expanduser('~')
+    path = os.path.join(base, 'hass_client')
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            return base
+    return path
+
+
 def slugify(value):
     allowed_chars = set('_0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
     return filter(lambda x: x in allowed_chars, value.replace(' ', '_').replace('-', '_'))
 
 
+def parseTypeValues(value):
+    # 'sensor:2,binary_sensor:0.5' -> {'sensor': 2.0, 'binary_sensor': 0.5}
+    result = {}
+    for part in (value or '').split(','):
+        key, _, number = part.partition(':')
+        try:
+            result[key.strip()] = float(number)
+        except ValueError:
+            continue
+    return result
+
+
+SensorMeta = namedtuple('SensorMeta', ['name', 'unit', 'device_class', 'state_class'])
+
+_unknownSensor = SensorMeta('unknown', '', None, 'measurement')
+
+# type -> (name, device_class), used for every scale of the type
+_sensorTypes = {
+    Device.TEMPERATURE: ('temp', 'temperature'),
+    Device.HUMIDITY: ('humidity', 'humidity'),
+    Device.RAINRATE: ('rrate', None),
+    Device.RAINTOTAL: ('rtot', None),
+    Device.WINDDIRECTION: ('wdir', None),
+    Device.WINDAVERAGE: ('wavg', None),
+    Device.WINDGUST: ('wgust', None),
+    Device.UV: ('uv', None),
+    Device.WATT: ('unknown', None),
+    Device.LUMINANCE: ('lum', 'illuminance'),
+    Device.DEW_POINT: ('dewp', 'temperature'),
+    Device.BAROMETRIC_PRESSURE: ('barpress', 'pressure'),
+    Device.GENERIC_METER: ('genmeter', None),
+    Device.WEIGHT: ('weight', 'weight'),
+    Device.CO2: ('co2', 'carbon_dioxide'),
+    Device.VOLUME: ('volume', 'gas'),
+    Device.LOUDNESS: ('loudness', 'sound_pressure'),
+    Device.PM25: ('pm25', 'pm25'),
+    Device.CO: ('co', 'carbon_monoxide'),
+    Device.MOISTURE: ('moisture', 'moisture')
+}
+
+# (type, scale) -> fields differing from the type defaults
+_sensorScales = {
+    (Device.WATT, 1): {'name': 'apparent energy', 'unit': 'kVAh'},  # Device.SCALE_POWER_KVAH
+    (Device.WATT, Device.SCALE_POWER_KWH): {'name': 'energy', 'unit': 'kWh', 'device_class': 'energy',
+                                            'state_class': 'total_increasing'},
+    (Device.WATT, Device.SCALE_POWER_WATT): {'name': 'power', 'unit': 'W', 'device_class': 'power'},
+    (Device.WATT, 4): {'name': 'volt', 'unit': 'V', 'device_class': 'voltage'},  # Device.SCALE_POWER_VOLT
+    (Device.WATT, 5): {'name': 'current', 'unit': 'A', 'device_class': 'current'},  # Device.SCALE_POWER_AMPERE
+    (Device.WATT, 6): {'name': 'power factor', 'unit': 'PF', 'device_class': 'power_factor'},  # Device.SCALE_POWER_POWERFACTOR
+    (Device.TEMPERATURE, Device.SCALE_TEMPERATURE_CELCIUS): {'unit': '°C'},
+    (Device.TEMPERATURE, Device.SCALE_TEMPERATURE_FAHRENHEIT): {'unit': '°F'},
+    (Device.HUMIDITY, Device.SCALE_HUMIDITY_PERCENT): {'unit': '%'},
+    (Device.RAINRATE, Device.SCALE_RAINRATE_MMH): {'unit': 'mm/h'},
+    (Device.RAINTOTAL, Device.SCALE_RAINTOTAL_MM): {'unit': 'mm', 'state_class': 'total_increasing'},
+    (Device.WINDDIRECTION, 0): {'unit': ''},
+    (Device.WINDAVERAGE, Device.SCALE_WIND_VELOCITY_MS): {'unit': 'm/s'},
+    (Device.WINDGUST, Device.SCALE_WIND_VELOCITY_MS): {'unit': 'm/s'},
+    (Device.LUMINANCE, Device.SCALE_LUMINANCE_PERCENT): {'unit': '%'},
+    (Device.LUMINANCE, Device.SCALE_LUMINANCE_LUX): {'unit': 'lux'},
+    (Device.BAROMETRIC_PRESSURE, Device.SCALE_BAROMETRIC_PRESSURE_KPA): {'unit': 'kPa'},
+    (Device.DEW_POINT, 0): {'unit': '°C'},
+    (Device.WEIGHT, 0): {'unit': 'kg'},
+    (Device.CO2, 0): {'unit': 'ppm'},
+    (Device.VOLUME, 0): {'unit': 'm³'},
+    (Device.LOUDNESS, 0): {'unit': 'dB'},
+    (Device.PM25, 0): {'unit': 'µg/m³'},
+    (Device.CO, 0): {'unit': 'ppm'},
+    (Device.MOISTURE, 0): {'unit': '%'}
+}
+
+
+def _buildSensorTable(overrides=None):
+    # (type, scale) -> SensorMeta, scale None is the entry for scales not listed
+    table = {}
+    for type, (name, deviceClass) in _sensorTypes.items():
+        table[(type, None)] = SensorMeta(name, '', deviceClass, 'measurement')
+    for (type, scale), fields in _sensorScales.items():
+        table[(type, scale)] = table.get((type, None), _unknownSensor)._replace(**fields)
+    for (type, scale), fields in sorted((overrides or {}).items(), key=lambda x: x[0][1] is not None):
+        if scale is None:
+            # type wide override, applies to all known scales of the type
+            for key in [x for x in table if x[0] == type] or [(type, None)]:
+                table[key] = table.get(key, _unknownSensor)._replace(**fields)
+        else:
+            table[(type, scale)] = table.get((type, scale), table.get((type, None), _unknownSensor))._replace(**fields)
+    return table
+
+
+_sensorTable = _buildSensorTable()
+
+
+def setSensorOverrides(overrides):
+    # overrides: {'<type>' or '<type>_<scale>': {'name'|'unit'|'device_class'|'state_class': value}}
+    global _sensorTable
+    parsed = {}
+    for key, fields in (overrides or {}).items():
+        type, _, scale = str(key).partition('_')
+        fields = dict((str(x), y) for x, y in fields.items() if x in SensorMeta._fields)
+        parsed[(int(type), int(scale) if scale else None)] = fields
+    _sensorTable = _buildSensorTable(parsed)
+
+
+def sensorMetadata(sensorType, sensorScale):
+    return _sensorTable.get((sensorType, sensorScale)) or _sensorTable.get((sensorType, None), _unknownSensor)
+
+
 def sensorTypeIntToStateClass(sensorType, sensorScale):
-    types = {
-        Device.RAINTOTAL: {
-            0: 'total_increasing'
-        },
-        Device.WATT: {
-            Device.SCALE_POWER_KWH: 'total_increasing'
-        }
-    }
-    return types.get(sensorType, {}).get(sensorScale, 'measurement')
+    return sensorMetadata(sensorType, sensorScale).state_class
 
 
 def sensorTypeIntToDeviceClass(sensorType, scaleType):
-    if sensorType == Device.WATT:
-        return {
-            Device.SCALE_POWER_KWH: 'energy',
-            Device.SCALE_POWER_WATT: 'power',
-            4: 'voltage',
-            5: 'current',
-            6: 'power_factor'
-        }.get(scaleType, None)
-
-    types = {
-        Device.TEMPERATURE: 'temperature',
-        Device.HUMIDITY: 'humidity',
-        Device.LUMINANCE: 'illuminance',
-        Device.BAROMETRIC_PRESSURE: 'pressure',
-        Device.CO2: 'carbon_dioxide',
-        Device.VOLUME: 'gas',
-        Device.LOUDNESS: 'signal_strenth',
-        Device.PM25: 'pm25',
-        Device.CO: 'carbon_monoxide'
-    }
-    return types.get(sensorType, None)
+    return sensorMetadata(sensorType, scaleType).device_class
 
 
 def sensorTypeIntToStr(sensorType, sensorScale):
-    # todo: add better names for type+scale combos, ex Device.WATT + Device.SCALE_KWH = energy
-    types = {
-        Device.TEMPERATURE: {None: 'temp'},
-        Device.HUMIDITY: {None: 'humidity'},
-        Device.RAINRATE: {None: 'rrate'},
-        Device.RAINTOTAL: {None: 'rtot'},
-        Device.WINDDIRECTION: {None: 'wdir'},
-        Device.WINDAVERAGE: {None: 'wavg'},
-        Device.WINDGUST: {None: 'wgust'},
-        Device.UV: {None: 'uv'},
-        Device.WATT: {
-            1: 'apparent energy',
-            Device.SCALE_POWER_KWH: 'energy',
-            Device.SCALE_POWER_WATT: 'power',
-            4: 'volt',
-            5: 'current',
-            6: 'power factor',
-            None: 'unknown'
-        },
-        Device.LUMINANCE: {None: 'lum'},
-        Device.DEW_POINT: {None: 'dewp'},
-        Device.BAROMETRIC_PRESSURE: {None: 'barpress'},
-        Device.GENERIC_METER: {None: 'genmeter'},
-        Device.WEIGHT: {None: 'weight'},
-        Device.CO2: {None: 'co2'},
-        Device.VOLUME: {None: 'volume'},
-        Device.LOUDNESS: {None: 'loudness'},
-        Device.PM25: {None: 'pm25'},
-        Device.CO: {None: 'co'},
-        Device.MOISTURE: {None: 'moisture'}
-    }
-    t = types.get(sensorType, {})
-    return t.get(sensorScale, None) or t.get(None, 'unknown')
+    return sensorMetadata(sensorType, sensorScale).name
 
 
 def sensorScaleIntToStr(type, scale):
-    scales = {
-        Device.WATT: {
-            1: 'kVAh',  # Device.SCALE_POWER_KVAH
-            Device.SCALE_POWER_KWH: 'kWh',
-            Device.SCALE_POWER_WATT: 'W',
-            4: 'V',  # Device.SCALE_POWER_VOLT
-            5: 'A',  # Device.SCALE_POWER_AMPERE
-            6: 'PF'  # Device.SCALE_POWER_POWERFACTOR
-        },
-        Device.TEMPERATURE: {
-            Device.SCALE_TEMPERATURE_CELCIUS: '°C',
-            Device.SCALE_TEMPERATURE_FAHRENHEIT: '°F'
-        },
-        Device.HUMIDITY: {
-            Device.SCALE_HUMIDITY_PERCENT: '%'
-        },
-        Device.RAINRATE: {
-            Device.SCALE_RAINRATE_MMH: 'mm/h'
-        },
-        Device.RAINTOTAL: {
-            Device.SCALE_RAINTOTAL_MM: 'mm'
-        },
-        Device.WINDDIRECTION: {
-            0: ''
-        },
-        Device.WINDAVERAGE: {
-            Device.SCALE_WIND_VELOCITY_MS: 'm/s'
-        },
-        Device.WINDGUST: {
-            Device.SCALE_WIND_VELOCITY_MS: 'm/s'
-        },
-        Device.LUMINANCE: {
-            Device.SCALE_LUMINANCE_PERCENT: '%',
-            Device.SCALE_LUMINANCE_LUX: 'lux'
-        },
-        Device.BAROMETRIC_PRESSURE: {
-            Device.SCALE_BAROMETRIC_PRESSURE_KPA: 'kPa'
-        }
-    }
-    return scales.get(type, {}).get(scale, '')
+    return sensorMetadata(type, scale).unit
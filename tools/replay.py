@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Replay a file written by the plugin recorder (record_file setting) into a Client
+# running against stand-in Telldus modules and an in-process fake broker.
+#
+#   python tools/replay.py events.log --speed 1    # real time
+#   python tools/replay.py events.log --speed 10   # 10x
+#   python tools/replay.py events.log --speed 0    # as fast as possible
+#   python tools/replay.py events.log --config sensor_aggregates=300,3600
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import standins
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def readEvents(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100.0), len(values) - 1)]
+
+
+def parseConfig(values):
+    # key=value pairs, values stay strings until the setting types are known
+    config = {}
+    for value in values or []:
+        key, _, raw = value.partition('=')
+        config[key.strip()] = raw
+    return config
+
+
+def convertConfig(config, defaults):
+    # only settings with a bool or number default are converted, everything else is a string
+    result = {}
+    for key, raw in config.items():
+        if key not in defaults:
+            raise SystemExit('Unknown setting %s' % key)
+        default = defaults[key]
+        if isinstance(default, bool):
+            result[key] = raw.strip().lower() in ('1', 'true', 'yes', 'on')
+        elif isinstance(default, (int, float)):
+            try:
+                result[key] = float(raw) if '.' in raw else int(raw)
+            except ValueError:
+                raise SystemExit('Setting %s needs a number, got %s' % (key, raw))
+        else:
+            result[key] = raw
+    return result
+
+
+class Replayer(object):
+    def __init__(self, events, config):
+        self.events = events
+        self.config = config
+        self.devices = {}
+        self.client = None
+        self.broker = None
+        self.latencies = {}
+
+    def _device(self, description):
+        device = self.devices.get(description['id'])
+        if device:
+            device.update(description)
+        else:
+            device = self.devices[description['id']] = standins.StandInDevice(description)
+        return device
+
+    def _startClient(self):
+        # devices described before the first discovery are what the plugin finds at boot
+        from hass_client import Client
+        standins.DeviceManager.devices = list(self.devices.values())
+        # a fresh registry so every replay starts cold
+        defaults = {'hostname': 'replay', 'registry_file': os.path.join(tempfile.mkdtemp(), 'registry.json')}
+        standins.Plugin.configOverrides = dict(defaults, **convertConfig(self.config, Client.configDefaults))
+        self.client = Client()
+        self.client.dispatcher.join()
+        self.broker = standins.FakeBrokerClient.instances[-1]
+
+    def _apply(self, kind, args):
+        client = self.client
+        if kind == 'deviceStateChanged':
+            device = self.devices.get(args[0])
+            if device:
+                device.setState(args[1], args[2])
+                client.onDeviceStateChanged(device, args[1], args[2], args[3] if len(args) > 3 else None)
+        elif kind == 'sensorValueUpdated':
+            device = self.devices.get(args[0])
+            if device:
+                device.setSensorValue(args[1], args[2], args[3])
+                client.onSensorValueUpdated(device, args[1], args[2], args[3])
+        elif kind == 'deviceAdded':
+            device = self._device(args[0])
+            standins.DeviceManager.devices = list(self.devices.values())
+            client.onDeviceAdded(device)
+        elif kind == 'deviceUpdated':
+            client.onDeviceUpdate(self._device(args[0]))
+        elif kind == 'deviceRemoved':
+            self.devices.pop(args[0], None)
+            standins.DeviceManager.devices = list(self.devices.values())
+            client.onDeviceRemoved(args[0])
+        elif kind == 'liveRegistered':
+            client.liveRegistered(None, None)
+        elif kind == 'liveDisconnected':
+            client.liveDisconnected()
+        elif kind == 'mqtt':
+            self.broker.deliver(args[0], args[1])
+        else:
+            return False
+        return True
+
+    def run(self, speed):
+        events = list(self.events)
+        header = next((x for x in events if x[1] == 'header'), None)
+        standins.install(header[2]['constants'] if header else {})
+        sys.path.insert(0, ROOT)
+        sys.path.insert(0, os.path.join(ROOT, 'hass_client'))
+
+        started = None
+        first = None
+        count = 0
+        for event in events:
+            timestamp, kind, args = event[0], event[1], event[2:]
+            if kind == 'device':
+                self._device(args[0])
+                continue
+            if self.client is None:
+                if kind != 'discovered':
+                    continue
+                self._startClient()
+                started = time.time()
+                first = timestamp
+                continue
+            if speed > 0:
+                delay = (timestamp - first) / speed - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            before = time.time()
+            if self._apply(kind, args):
+                self.client.dispatcher.join()
+                self.latencies.setdefault(kind, []).append(time.time() - before)
+                count += 1
+        if self.client is None:
+            raise SystemExit('No discovery found in recording')
+        # added devices wait for a batch window on a dispatcher timer, join does not wait for timers
+        self.client.flushAddedDevices()
+        self.client.dispatcher.join()
+        return count, time.time() - started
+
+    def report(self, count, elapsed):
+        print('events:        %d' % count)
+        print('elapsed:       %.3f s' % elapsed)
+        print('throughput:    %.1f events/s' % (count / elapsed if elapsed else 0.0))
+        print('published:     %d messages, %d bytes' % (self.broker.published, self.broker.publishedBytes))
+        print('latency (ms)   %-8s %-8s %-8s %-8s %s' % ('p50', 'p90', 'p99', 'max', 'count'))
+        for kind, values in sorted(self.latencies.items()):
+            print('  %-20s %-8.2f %-8.2f %-8.2f %-8.2f %d' % (
+                kind,
+                percentile(values, 50) * 1000,
+                percentile(values, 90) * 1000,
+                percentile(values, 99) * 1000,
+                max(values) * 1000,
+                len(values)
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded Telldus/mqtt events into the plugin')
+    parser.add_argument('file', help='file written by the record_file setting')
+    parser.add_argument('--speed', type=float, default=0, help='1 for real time, N for N times faster, 0 for max speed')
+    parser.add_argument('--config', action='append', help='plugin setting as key=value, can be repeated')
+    args = parser.parse_args()
+
+    replayer = Replayer(readEvents(args.file), parseConfig(args.config))
+    count, elapsed = replayer.run(args.speed)
+    replayer.report(count, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+# Minimal stand-ins for the Telldus firmware modules and paho, enough to run
+# hass_client.Client outside a TellStick for replaying recorded events.
+import sys
+import time
+import types
+
+
+class Application(object):
+    def registerShutdown(self, fn):
+        pass
+
+
+class Configuration(object):
+    def __init__(self, defaultValue=None, **kwargs):
+        self.defaultValue = defaultValue
+
+
+def configuration(**kwargs):
+    def decorate(cls):
+        cls.configDefaults = dict((key, value.defaultValue) for key, value in kwargs.items())
+        return cls
+    return decorate
+
+
+class Plugin(object):
+    context = None
+    configOverrides = {}
+
+    def _values(self):
+        if not hasattr(self, '_configValues'):
+            self._configValues = dict(getattr(self, 'configDefaults', {}))
+            self._configValues.update(Plugin.configOverrides)
+        return self._configValues
+
+    def config(self, key):
+        return self._values().get(key)
+
+    def setConfig(self, key, value):
+        self._values()[key] = value
+
+
+def implements(*interfaces):
+    pass
+
+
+class ISignalObserver(object):
+    pass
+
+
+def slot(message=''):
+    def decorate(fn):
+        fn.slot = message
+        return fn
+    return decorate
+
+
+class StandInDevice(object):
+    # recreated from Recorder.describeDevice output
+    def __init__(self, description):
+        self.commands = []
+        self.update(description)
+
+    def update(self, description):
+        self.description = description
+        self._state = tuple(description.get('state') or (0, None))
+        self._sensors = dict(
+            (int(type), [dict(x) for x in sensors]) for type, sensors in (description.get('sensors') or {}).items()
+        )
+
+    def id(self):
+        return self.description['id']
+
+    def name(self):
+        return self.description.get('name', '')
+
+    def isDevice(self):
+        return self.description.get('isDevice', False)
+
+    def isSensor(self):
+        return self.description.get('isSensor', False)
+
+    def methods(self):
+        return self.description.get('methods', 0)
+
+    def battery(self):
+        return self.description.get('battery')
+
+    def allParameters(self):
+        return self.description.get('parameters') or {}
+
+    def parameters(self):
+        return self.allParameters()
+
+    def typeString(self):
+        return self.description.get('typeStr', '')
+
+    def getOrCreateUUID(self):
+        return self.description.get('uuid', '')
+
+    def protocol(self):
+        return self.description.get('protocol', '')
+
+    def model(self):
+        return self.description.get('model', '')
+
+    def room(self):
+        return self.description.get('room')
+
+    def state(self):
+        return self._state
+
+    def setState(self, state, stateValue):
+        self._state = (state, stateValue)
+
+    def stateValue(self, stateType, default=None):
+        return default
+
+    def sensorValues(self):
+        return self._sensors
+
+    def sensorValue(self, type, scale):
+        return next((x.get('value') for x in self._sensors.get(type, []) if x.get('scale') == scale), None)
+
+    def setSensorValue(self, type, value, scale):
+        sensors = self._sensors.setdefault(type, [])
+        sensor = next((x for x in sensors if x.get('scale') == scale), None)
+        if sensor is None:
+            sensor = {'scale': scale}
+            sensors.append(sensor)
+        sensor.update({'value': value, 'lastUpdated': int(time.time())})
+
+    def command(self, action, origin=None, success=None, failure=None, **kwargs):
+        self.commands.append((action, kwargs))
+        if success:
+            success()
+
+
+class DeviceManager(object):
+    devices = []
+
+    def __init__(self, context=None):
+        pass
+
+    def retrieveDevices(self):
+        return list(DeviceManager.devices)
+
+
+class TelldusLive(object):
+    registered = True
+
+    def __init__(self, context=None):
+        pass
+
+
+class Board(object):
+    @staticmethod
+    def networkInterface():
+        return 'eth0'
+
+    @staticmethod
+    def product():
+        return 'tellstick-znet-lite-v2'
+
+    @staticmethod
+    def firmwareVersion():
+        return 'replay'
+
+
+class MqttMessage(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeBrokerClient(object):
+    # in-process broker stand-in for paho.mqtt.client.Client, connects immediately
+    # and counts what is published
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.subscriptions = []
+        self.published = 0
+        self.publishedBytes = 0
+        self.connected = False
+        FakeBrokerClient.instances.append(self)
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        pass
+
+    def connect_async(self, host, port=1883, keepalive=60, **kwargs):
+        pass
+
+    def loop_start(self):
+        if not self.connected:
+            self.connected = True
+            if self.on_connect:
+                self.on_connect(self, None, {}, 0)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        if self.connected:
+            self.connected = False
+            if self.on_disconnect:
+                self.on_disconnect(self, None, 0)
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+
+    def unsubscribe(self, topic):
+        if topic in self.subscriptions:
+            self.subscriptions.remove(topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published += 1
+        self.publishedBytes += len(topic) + len(str(payload) if payload is not None else '')
+
+    def deliver(self, topic, payload):
+        if self.on_message:
+            self.on_message(self, None, MqttMessage(topic, payload))
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install(constants):
+    # register the stand-ins in sys.modules, Device constants come from the recording header
+    device = type('Device', (object,), dict(constants))
+    _module('base', Application=Application, Plugin=Plugin, configuration=configuration,
+            ConfigurationNumber=Configuration, ConfigurationString=Configuration, ConfigurationBool=Configuration,
+            ConfigurationSelect=Configuration, ConfigurationList=Configuration, implements=implements,
+            ISignalObserver=ISignalObserver, slot=slot)
+    _module('telldus', Device=device, Thermostat=type('Thermostat', (object,), {}), DeviceManager=DeviceManager)
+    _module('tellduslive', base=_module('tellduslive.base', TelldusLive=TelldusLive))
+    _module('board', Board=Board)
+    _module('netifaces', AF_LINK=17, AF_INET=2,
+            ifaddresses=lambda iface: {17: [{'addr': '00:00:00:00:00:00'}], 2: [{'addr': '127.0.0.1'}]})
+    _module('psutil', cpu_percent=lambda interval=None: 0.0,
+            virtual_memory=lambda: type('Memory', (object,), {'available': 1, 'total': 2})(),
+            net_io_counters=lambda: type('NetIO', (object,), {'bytes_sent': 0, 'bytes_recv': 0})())
+    client = _module('paho.mqtt.client', Client=FakeBrokerClient)
+    _module('paho', mqtt=_module('paho.mqtt', client=client))